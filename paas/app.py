@@ -1,14 +1,20 @@
 #!/usr/bin/env python
 
-from flask import Flask, abort, jsonify, make_response
+import json
+import threading
+
+from flask import Flask, abort, jsonify, make_response, request
 from flask_restful import Api, Resource, fields, marshal, reqparse
 from flask_httpauth import HTTPBasicAuth
+from flask_socketio import SocketIO, emit
+from werkzeug.http import quote_etag
 
 from pixelcontrol import PixelDB
 
 app = Flask(__name__, static_url_path="")
 api = Api(app)
 auth = HTTPBasicAuth()
+socketio = SocketIO(app)
 
 pixelDB = PixelDB()
 
@@ -27,13 +33,15 @@ base_api_path = '/paas/api'
 base_api_path_v1 = base_api_path + '/v1.0'
 
 
-def get_all_pixels():
-    data = pixelDB.get_pixels()
+def get_all_pixels(data=None):
+    if data is None:
+        data = pixelDB.get_pixels()
     return (
         {
             'id': d['id'],
             'colour': d['colour'],
             'time': d['time'],
+            'version': d['version'],
         } for d in data if d is not None)
 
 def get_pixel(pixelid):
@@ -42,16 +50,59 @@ def get_pixel(pixelid):
     data = {
         'id': pixelid,
         'colour': pixel['colour'] if pixel is not None else dict(zip('rgb', (0, 0, 0))),
-        'time': 0 if pixel is None else pixel['time']
+        'time': 0 if pixel is None else pixel['time'],
+        'version': pixelDB.pixel_version(pixelid) if pixel is None else pixel['version'],
     }
     return data
 
+def not_modified(version):
+    """Return a 304 response if the request already has the version,
+    otherwise None."""
+    etag = pixelDB.tag(version)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def valid_colour(colour):
+    return (isinstance(colour, dict) and
+            all(isinstance(colour.get(c), int) and 0 <= colour[c] <= 255
+                for c in 'rgb'))
+
+
+def set_pixels(items):
+    """Set many pixels with a single update, returning a result for each
+    (id, colour) item in the same order."""
+    results = []
+    valid = []
+    for index, (pixelid, colour) in enumerate(items):
+        if not isinstance(pixelid, int) or isinstance(pixelid, bool) or \
+                pixelid < 0:
+            results.append({'index': index, 'status': 'error',
+                            'message': 'Invalid pixel id'})
+        elif not valid_colour(colour):
+            results.append({'index': index, 'id': pixelid, 'status': 'error',
+                            'message': 'Colour must have r, g and b from '
+                                       '0 to 255'})
+        else:
+            results.append(None)
+            valid.append((index, pixelid, colour))
+
+    updated = pixelDB.set_pixels([(i, c) for _, i, c in valid])
+    for (index, pixelid, _), pixel in zip(valid, updated):
+        results[index] = {'index': index, 'id': pixelid, 'status': 'ok',
+                          'pixel': marshal(pixel, pixel_fields)}
+    return results
+
+
 def set_pixel(pixelid, colour):
     pixel = pixelDB.set_pixel(pixelid, colour)
     data = {
         'id': pixelid,
         'colour': pixel['colour'] if pixel is not None else dict(zip('rgb', (0, 0, 0))),
         'time': 0 if pixel is None else pixel['time'],
+        'version': 0 if pixel is None else pixel['version'],
     }
     return data
 
@@ -68,24 +119,96 @@ colour_fields = {
 pixel_fields = {
     'colour': fields.Nested(colour_fields),
     'time': fields.Integer,
+    'version': fields.Integer,
     'uri': fields.Url('pixel')
 }
 
 
+class PixelListCache(object):
+    """The serialized body of the full pixel list, kept up to date by
+    re-marshalling only the pixels whose versions have changed."""
+
+    def __init__(self, db):
+        self.db = db
+        self.version = 0
+        self.body = None
+        self.fragments = {}
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the current version and the body for it."""
+        with self._lock:
+            if self.body is None or self.version != self.db.version:
+                version, changed, deleted = self.db.changes_since(
+                    self.version)
+                for pixelid in deleted:
+                    self.fragments.pop(pixelid, None)
+                for pixel in get_all_pixels(changed):
+                    self.fragments[pixel['id']] = json.dumps(
+                        marshal(pixel, pixel_fields))
+                self.body = '{{"version": {}, "pixels": [{}]}}\n'.format(
+                    json.dumps(self.db.tag(version)), ', '.join(
+                        self.fragments[i] for i in sorted(self.fragments))
+                ).encode('utf-8')
+                self.version = version
+            return self.version, self.body
+
+pixel_list_cache = PixelListCache(pixelDB)
+
+
 class PixelListAPI(Resource):
     decorators = [auth.login_required]
 
     def __init__(self):
         self.reqparse = reqparse.RequestParser()
         self.reqparse.add_argument(
-            'colour', type=list, required=True,
-            help='Missing colour for pixel', location='json')
+            'pixels', type=list, location='json',
+            help='pixels must be a list of {"id": ..., "colour": ...}')
         self.reqparse.add_argument(
-            'time', type=int, default=-1, location='json')
+            'frame', type=list, location='json',
+            help='frame must be a list of colours, one per pixel from 0')
         super(PixelListAPI, self).__init__()
 
     def get(self):
-        return {'pixels': [marshal(p, pixel_fields) for p in get_all_pixels()]}
+        """Return every pixel, or with ?since=<version> only the pixels
+        changed and the ids deleted after that version, where version is
+        from an earlier response. A version from another process or
+        before a restart gets every pixel, with 'full' set."""
+        since_tag = request.args.get('since')
+        response = not_modified(pixelDB.version)
+        if response is not None:
+            return response
+        if since_tag is None:
+            version, body = pixel_list_cache.get()
+            response = app.response_class(body, mimetype='application/json')
+            response.set_etag(pixelDB.tag(version))
+            return response
+        since = pixelDB.version_from_tag(since_tag)
+        version, changed, deleted = pixelDB.changes_since(since or 0)
+        data = {
+            'version': pixelDB.tag(version),
+            'pixels': [marshal(p, pixel_fields)
+                       for p in get_all_pixels(changed)],
+            'deleted': deleted if since is not None else [],
+            'full': since is None,
+        }
+        return data, 200, {'ETag': quote_etag(pixelDB.tag(version))}
+
+    def put(self):
+        """Update many pixels at once, given either 'pixels', a list of
+        id and colour pairs, or 'frame', a list of colours for the pixels
+        numbered from 0."""
+        args = self.reqparse.parse_args()
+        if args['pixels'] is not None:
+            items = [(p.get('id'), p.get('colour')) if isinstance(p, dict)
+                     else (None, None) for p in args['pixels']]
+        elif args['frame'] is not None:
+            items = list(enumerate(args['frame']))
+        else:
+            abort(400)
+        results = set_pixels(items)
+        errors = sum(1 for r in results if r['status'] != 'ok')
+        return {'results': results, 'errors': errors}
 
 
 class PixelAPI(Resource):
@@ -100,25 +223,28 @@ class PixelAPI(Resource):
         super(PixelAPI, self).__init__()
 
     def get(self, id):
+        response = not_modified(pixelDB.pixel_version(id))
+        if response is not None:
+            return response
         pixel = get_pixel(id)
         if pixel is None:
             abort(404)
-        return {'pixel': marshal(pixel, pixel_fields)}
+        return ({'pixel': marshal(pixel, pixel_fields)}, 200,
+                {'ETag': quote_etag(pixelDB.tag(pixel['version']))})
 
     def put(self, id):
-        pixel = get_pixel(id)
-        if pixel is None:
-            abort(404)
         args = self.reqparse.parse_args()
-        for k, v in args.iteritems():
-            if v != None:
-                pixel[k] = v
-        updated_pixel = set_pixel(id, pixel['colour'])
+        colour = args['colour']
+        if colour is None:
+            colour = get_pixel(id)['colour']
+        elif not valid_colour(colour):
+            abort(400, 'Colour must have r, g and b from 0 to 255')
+        updated_pixel = set_pixel(id, colour)
         return {'pixel': marshal(updated_pixel, pixel_fields)}
 
     def delete(self, id):
         pixel = get_pixel(id)
-        if pixel is None or pixel.get('time', 0) is 0:
+        if pixel is None or pixel.get('time', 0) == 0:
             abort(404)
         result = delete_pixel(id)
         return {'result': result}
@@ -127,6 +253,38 @@ api.add_resource(PixelListAPI, base_api_path_v1 + '/pixels', endpoint = 'pixels'
 api.add_resource(PixelAPI, base_api_path_v1 + '/pixels/<int:id>', endpoint = 'pixel')
 
 
+# Pixel changes are pushed to Socket.IO clients on the stream namespace:
+# a 'snapshot' event with every pixel on connecting, then a 'pixels' event
+# with the pixels changed and ids deleted by each update to the display.
+stream_namespace = base_api_path_v1 + '/stream'
+
+stream_fields = {
+    'id': fields.Integer,
+    'colour': fields.Nested(colour_fields),
+    'time': fields.Integer,
+    'version': fields.Integer,
+}
+
+
+@socketio.on('connect', namespace=stream_namespace)
+def stream_connect():
+    credentials = request.authorization
+    if credentials is None or \
+            get_password(credentials.username) != credentials.password:
+        return False
+    emit('snapshot', {
+        'pixels': [marshal(p, stream_fields) for p in get_all_pixels()]})
+
+
+def broadcast_pixels(changed, deleted):
+    socketio.emit('pixels', {
+        'pixels': [marshal(p, stream_fields) for p in changed],
+        'deleted': deleted,
+    }, namespace=stream_namespace)
+
+pixelDB.add_listener(broadcast_pixels)
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    socketio.run(app, debug=True)
 
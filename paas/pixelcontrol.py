@@ -0,0 +1,280 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""The backend of the REST API.
+
+Pixels are identified by number in the API and by the key 'item_<id>'
+everywhere else. Reads are answered from a local cache that is loaded
+from a snapshot from paas_db and kept up to date by subscribing to the
+pixel topics published by the core, so they never need a network round
+trip. Writes are sent to the core and applied to the cache straight away.
+
+Each thread using the PixelDB gets its own sockets, since zeromq sockets
+must not be shared between threads.
+
+Every change to the cache is given a version from a counter that only
+goes up, and each pixel remembers the version that last changed it.
+Deleted pixels leave a tombstone with the version of their deletion, so
+changes_since can report everything that changed after a given version.
+Versions only mean anything within one process, so those handed to
+clients are tagged with an epoch chosen when the PixelDB is created.
+
+Writes made through this PixelDB change the cache, and notify listeners
+added with add_listener, straight away. Their echoes from the core then
+change nothing, and are neither given a new version nor passed on.
+Listeners are called with the pixels changed and the ids deleted.
+"""
+
+import json
+import re
+import threading
+import time
+import uuid
+import zmq
+from paas_common import messaging, settings
+
+try:
+    API_DB_TIMEOUT = settings.api_db_timeout
+except AttributeError:
+    API_DB_TIMEOUT = 2000
+
+KEY_FORMAT = 'item_{}'
+KEY_PATTERN = re.compile(r'^item_(\d+)$')
+
+
+def key_for_id(pixelid):
+    return KEY_FORMAT.format(pixelid)
+
+
+def id_for_key(key):
+    match = KEY_PATTERN.match(key or '')
+    return int(match.group(1)) if match else None
+
+
+def colour_from_rgb(rgb):
+    return dict(zip('rgb', rgb or (0, 0, 0)))
+
+
+def rgb_from_colour(colour):
+    return [int(colour.get(c, 0)) for c in 'rgb']
+
+
+class PixelDB(object):
+
+    def __init__(self, context=None):
+        self.context = context or zmq.Context.instance()
+        self.pixels = {}
+        self.version = 0
+        self.epoch = uuid.uuid4().hex[:12]
+        # version at which each deleted pixel was deleted
+        self.deleted = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._listeners = []
+        self._follower = threading.Thread(target=self._follow, daemon=True)
+        self._follower.start()
+
+    def _sender(self):
+        sender = getattr(self._local, 'sender', None)
+        if sender is None:
+            sender = self._local.sender = messaging.connect_sender(
+                self.context)
+        return sender
+
+    def query(self, request):
+        """Send a request to paas_db (see paas_db.query) and return the
+        reply, or None if the database does not answer in time."""
+        dbsocket = getattr(self._local, 'dbsocket', None)
+        if dbsocket is None:
+            dbsocket = self._local.dbsocket = self.context.socket(zmq.REQ)
+            dbsocket.setsockopt(zmq.LINGER, 0)
+            dbsocket.connect(settings.dbPort)
+        dbsocket.send_string(json.dumps(request))
+        if not dbsocket.poll(API_DB_TIMEOUT):
+            # a REQ socket cannot send again until it has a reply
+            dbsocket.close()
+            self._local.dbsocket = None
+            return None
+        return json.loads(dbsocket.recv().decode('utf-8'))
+
+    def _store(self, key, rgb, when):
+        pixelid = id_for_key(key) if isinstance(key, str) else None
+        if pixelid is None or rgb is not None and (
+                not isinstance(rgb, (list, tuple)) or len(rgb) != 3):
+            return None
+        colour = colour_from_rgb(rgb)
+        current = self.pixels.get(pixelid)
+        if current is not None and current['colour'] == colour:
+            return None
+        self.version += 1
+        self.deleted.pop(pixelid, None)
+        pixel = self.pixels[pixelid] = {
+            'id': pixelid,
+            'colour': colour,
+            'time': when,
+            'version': self.version,
+        }
+        return pixel
+
+    def _remove(self, pixelid):
+        pixel = self.pixels.pop(pixelid, None)
+        if pixel is not None:
+            self.version += 1
+            self.deleted[pixelid] = self.version
+        return pixel
+
+    def add_listener(self, listener):
+        """Call listener(changed, deleted) with the list of pixels set and
+        the list of ids deleted by each message published by the core."""
+        self._listeners.append(listener)
+
+    def _apply(self, message):
+        topic, data = message.topic, message.data
+        if not isinstance(data, dict):
+            return
+        now = int(time.time())
+        changed = []
+        deleted = []
+        with self._lock:
+            if topic == 'paas_pixel':
+                changed.append(
+                    self._store(data.get('key'), data.get('rgb'), now))
+            elif topic == 'paas_multipixel':
+                pixels = data.get('pixels', [])
+                for pixel in pixels if isinstance(pixels, list) else []:
+                    if isinstance(pixel, dict):
+                        changed.append(self._store(
+                            pixel.get('key'), pixel.get('rgb'), now))
+            elif topic == 'paas_allpixels':
+                for pixelid in list(self.pixels):
+                    changed.append(self._store(
+                        key_for_id(pixelid), data.get('rgb'), now))
+            elif topic == 'paas_deletepixel':
+                for key in messaging.deleted_keys(data):
+                    if not isinstance(key, str):
+                        continue
+                    pixelid = id_for_key(key)
+                    if self._remove(pixelid) is not None:
+                        deleted.append(pixelid)
+        changed = [pixel for pixel in changed if pixel is not None]
+        self._notify(changed, deleted)
+
+    def _notify(self, changed, deleted):
+        if changed or deleted:
+            for listener in self._listeners:
+                listener(changed, deleted)
+
+    def _follow(self):
+        subsocket = messaging.connect_subscriber(self.context, u'paas_')
+
+        # subscribe before taking the snapshot so nothing is missed between
+        snapshot = self.query({'op': 'snapshot'}) or {}
+        with self._lock:
+            for key, record in snapshot.get('pixels', {}).items():
+                if record is not None:
+                    self._store(key, record.get('rgb'), record.get('time', 0))
+
+        try:
+            while True:
+                try:
+                    messages = [messaging.recv_message(subsocket)]
+                except messaging.WireFormatError as e:
+                    print("Ignoring message: {}".format(e))
+                    messages = []
+                if messaging.sequence_tracker.resync:
+                    # messages were dropped; catch up with the core
+                    with self._lock:
+                        known = [key_for_id(i) for i in self.pixels]
+                    messages.extend(
+                        messaging.resync(self.context, u'paas_', known)[1])
+                for message in messages:
+                    try:
+                        self._apply(message)
+                    except Exception as e:
+                        # keep following, or the cache would go stale
+                        print("Ignoring message: {}".format(e))
+        except zmq.ContextTerminated:
+            subsocket.close()
+
+    def get_pixels(self):
+        with self._lock:
+            return list(self.pixels.values())
+
+    def get_pixel(self, pixelid):
+        with self._lock:
+            return self.pixels.get(pixelid)
+
+    def pixel_version(self, pixelid):
+        """Return the version that last set or deleted the pixel, or 0."""
+        with self._lock:
+            pixel = self.pixels.get(pixelid)
+            if pixel is not None:
+                return pixel['version']
+            return self.deleted.get(pixelid, 0)
+
+    def tag(self, version):
+        """Return the version as a tag for clients."""
+        return '{}-{}'.format(self.epoch, version)
+
+    def version_from_tag(self, tag):
+        """Return the version from a tag given by this PixelDB, or None."""
+        epoch, _, version = (tag or '').rpartition('-')
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def changes_since(self, since):
+        """Return the current version, the pixels set after version since
+        and the ids of those deleted after it."""
+        with self._lock:
+            changed = [p for p in self.pixels.values() if p['version'] > since]
+            deleted = [i for i, v in self.deleted.items() if v > since]
+            return self.version, changed, deleted
+
+    def set_pixel(self, pixelid, colour):
+        rgb = rgb_from_colour(colour)
+        messaging.send_data(self._sender(), 'paas_pixel',
+                            {'key': key_for_id(pixelid), 'rgb': rgb})
+        with self._lock:
+            changed = self._store(key_for_id(pixelid), rgb, int(time.time()))
+            pixel = self.pixels[pixelid]
+        if changed is not None:
+            self._notify([changed], [])
+        return pixel
+
+    def set_pixels(self, items):
+        """Set each of the (id, colour) items with a single message,
+        returning the updated pixels."""
+        if not items:
+            return []
+        pixels = [{'key': key_for_id(pixelid), 'rgb': rgb_from_colour(colour)}
+                  for pixelid, colour in items]
+        messaging.send_data(self._sender(), 'paas_multipixel',
+                            {'pixels': pixels})
+        now = int(time.time())
+        with self._lock:
+            changed = [self._store(pixel['key'], pixel['rgb'], now)
+                       for pixel in pixels]
+            updated = [self.pixels[pixelid] for pixelid, _ in items]
+        self._notify([pixel for pixel in changed if pixel is not None], [])
+        return updated
+
+    def delete_pixel(self, pixelid):
+        messaging.send_data(self._sender(), 'paas_deletepixel',
+                            {'key': key_for_id(pixelid)})
+        with self._lock:
+            pixel = self._remove(pixelid)
+        if pixel is not None:
+            self._notify([], [pixelid])
+        return pixel
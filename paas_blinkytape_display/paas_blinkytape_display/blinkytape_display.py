@@ -21,6 +21,17 @@ anything that has valid json in the form
 
   {'key': 'abc', 'rgb': [1, 2, 3]}
 
+Several pixels can be updated with a single 'paas_multipixel' message
+that is rendered once all of the pixels have been set:
+
+  {'pixels': [{'key': 'abc', 'rgb': [1, 2, 3]}, ...]}
+
+and a 'paas_deletepixel' message naming a key, or a list of 'keys',
+blanks their pixels and frees their positions for other keys.
+
+Updates are shown at most render.DISPLAY_FPS times a second, with any
+that arrive in between coalesced into a single refresh.
+
 Note that this is not necessarily directly related to how the data
 should be structured for input to the publisher - this is only what
 the publisher should provide that this subscriber will understand.
@@ -29,89 +40,79 @@ This modules is expected to be run directly as its own process.
 """
 
 
-import json
-import random
 import sys
 import zmq
 from blinkytape import BlinkyTape, listPorts
-from paas_common import settings
+from paas_common import display, messaging, settings, tracing
+from paas_common.framebuffer import FrameBuffer
 
 port = listPorts()[0]
 blinky = BlinkyTape(port)
 
-keymap = {}
-all_positions = set(i for i in range(blinky.ledCount))
+all_positions = list((i, 0) for i in range(blinky.ledCount))
 
 context = zmq.Context()
-subsocket = context.socket(zmq.SUB)
-subsocket.connect(settings.pubSubPort)
 
 topic_filter = sys.argv[1] if len(sys.argv) > 1 else "paas_"
 
 if isinstance(topic_filter, bytes):
     topic_filter = topic_filter.decode('ascii')
-subsocket.setsockopt_string(zmq.SUBSCRIBE, topic_filter)
+subsocket = messaging.connect_subscriber(context, topic_filter)
+
+# The tape reads r, g, b bytes for each LED in turn from the start of the
+# strip until a 255 byte tells it to show them, so colours are clamped to
+# 254. LEDs after the last one sent keep their colour, which means a frame
+# only needs to run as far as the last pixel that changed.
+SHOW_BYTE = 255
+CLAMP = bytes(range(255)) + bytes((254,))
 
 try:
-    ALLOCATION_SCHEME = settings.pixel_allocation_scheme
+    DELTA_FRAMES = settings.blinkytape_delta_frames
 except AttributeError:
-    ALLOCATION_SCHEME = 'linear'
-
-
-def get_position_for_key(key):
-    if key in keymap:
-        return keymap[key]
-
-    positions = all_positions - set(keymap.values())
-    if not positions:
-        return (0, 0)
-
-    if ALLOCATION_SCHEME == 'random':
-        position = random.choice(list(positions))
-    else:
-        position = sorted(list(positions))[-1]
-    keymap[key] = position
-    return position
-
-pixel_values = [(0, 0, 0)] * blinky.ledCount
-
-
-def set_pixel(data):
-    key = data.get('key', None)
-    i = get_position_for_key(key)
-    r, g, b = data.get('rgb', (None, None, None))
-    pixel_values[i] = (r, g, b)
-
-
-def set_all_pixels(data):
-    r, g, b = data.get('rgb', (0, 0, 0))
-    for p in range(len(pixel_values)):
-        pixel_values[p] = (r, g, b)
-
-
-def update_display():
-    for p in pixel_values:
-        blinky.sendPixel(p)
-    blinky.show()
-
-
-def mainloop():
-    while True:
-        response = subsocket.recv_string()
-        topic, *splitdata = response.split()
-        data = json.loads(' '.join(splitdata))
-        if topic == 'paas_pixel':
-            set_pixel(data)
-        elif topic == 'paas_allpixels':
-            set_all_pixels(data)
-
-        if topic == 'paas_showpixels' or data.get('show', True):
-            update_display()
+    DELTA_FRAMES = True
+
+
+class BlinkyTapeDisplay(display.Display):
+
+    def __init__(self):
+        super(BlinkyTapeDisplay, self).__init__(
+            FrameBuffer(blinky.ledCount), all_positions)
+        self.frame = bytearray(blinky.ledCount * 3 + 1)
+        # number of leading pixels that must be sent to bring the tape up
+        # to date
+        self.dirty_length = blinky.ledCount
+
+    def mark_pixels_dirty(self, length):
+        self.dirty_length = max(self.dirty_length, length)
+
+    def set_position(self, position, rgb):
+        if not super(BlinkyTapeDisplay, self).set_position(position, rgb):
+            return False
+        self.mark_pixels_dirty(position[0] + 1)
+        return True
+
+    def set_all_pixels(self, data):
+        if not super(BlinkyTapeDisplay, self).set_all_pixels(data):
+            return False
+        self.mark_pixels_dirty(len(self.framebuffer))
+        return True
+
+    def update_display(self):
+        """Send the changed part of the frame to the tape in a single
+        write."""
+        length = (self.dirty_length if DELTA_FRAMES
+                  else len(self.framebuffer))
+        end = length * 3
+        self.frame[:end] = self.framebuffer.pixels[:end].translate(CLAMP)
+        self.frame[end] = SHOW_BYTE
+        blinky.serial.write(memoryview(self.frame)[:end + 1])
+        self.dirty_length = 0
 
 
 def main():
+    tracing.report_on_signal(messaging.sequence_tracker.report)
     try:
-        mainloop()
+        BlinkyTapeDisplay().run(subsocket, context, topic_filter)
     except KeyboardInterrupt:
         print("...\nInterrupt received; cleaning up and exiting.")
     finally:
@@ -0,0 +1,84 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Allocation of display positions to the keys of incoming pixels.
+
+With the 'linear' scheme free positions are handed out from the highest
+first; with the 'random' scheme any free position may be chosen. Once
+every position is in use, the key that was least recently updated gives
+up its position to the new key.
+"""
+
+from collections import OrderedDict
+import heapq
+import random
+
+
+class SlotAllocator(object):
+
+    def __init__(self, positions, scheme='linear'):
+        self.positions = sorted(positions)
+        self.scheme = scheme
+        # key -> index into positions, least recently updated first
+        self.keymap = OrderedDict()
+        if scheme == 'random':
+            self.free = list(range(len(self.positions)))
+        else:
+            # a heap of negated indices so that the highest pops first
+            self.free = [-i for i in reversed(range(len(self.positions)))]
+
+    def __len__(self):
+        return len(self.keymap)
+
+    def __contains__(self, key):
+        return key in self.keymap
+
+    def _take_free(self):
+        if self.scheme == 'random':
+            i = random.randrange(len(self.free))
+            self.free[i], self.free[-1] = self.free[-1], self.free[i]
+            return self.free.pop()
+        return -heapq.heappop(self.free)
+
+    def _put_free(self, index):
+        if self.scheme == 'random':
+            self.free.append(index)
+        else:
+            heapq.heappush(self.free, -index)
+
+    def get_position(self, key):
+        """Return the position for the key, allocating one if needed, and
+        mark the key as the most recently updated."""
+        index = self.keymap.get(key)
+        if index is not None:
+            self.keymap.move_to_end(key)
+            return self.positions[index]
+
+        if self.free:
+            index = self._take_free()
+        elif self.keymap:
+            _, index = self.keymap.popitem(last=False)
+        else:
+            raise ValueError("No positions to allocate from")
+        self.keymap[key] = index
+        return self.positions[index]
+
+    def release(self, key):
+        """Free the position held by the key, returning it or None if the
+        key had no position."""
+        index = self.keymap.pop(key, None)
+        if index is None:
+            return None
+        self._put_free(index)
+        return self.positions[index]
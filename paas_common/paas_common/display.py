@@ -0,0 +1,149 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""The handling of published pixel messages shared by the displays.
+
+A Display gives each key a position in its framebuffer from a
+paas_common.allocator.SlotAllocator and applies the paas_pixel,
+paas_multipixel, paas_allpixels and paas_deletepixel topics to it, with
+presents paced by a paas_common.render.RenderScheduler. Each kind of
+display subclasses it and supplies update_display, which is called to
+send the framebuffer to the hardware whenever it is shown. Pixels that
+cannot be drawn, such as those with no usable colour, are reported and
+skipped rather than stopping the display.
+
+run starts from the core's snapshot, fetches a fresh one whenever
+messages are found to be missing and otherwise draws on the messages
+published to a subscriber socket.
+"""
+
+from paas_common import allocator, messaging, render, settings
+from paas_common.framebuffer import colour_bytes
+
+try:
+    ALLOCATION_SCHEME = settings.pixel_allocation_scheme
+except AttributeError:
+    ALLOCATION_SCHEME = 'linear'
+
+
+class Display(object):
+
+    def __init__(self, framebuffer, positions, scheme=ALLOCATION_SCHEME,
+                 fps=render.DISPLAY_FPS):
+        self.framebuffer = framebuffer
+        self.slots = allocator.SlotAllocator(positions, scheme)
+        self.scheduler = render.RenderScheduler(fps)
+
+    def update_display(self):
+        raise NotImplementedError
+
+    def set_position(self, position, rgb):
+        """Set the colour at an (x, y) position, returning whether it
+        changed."""
+        x, y = position
+        return self.framebuffer.set_pixel(x, y, rgb)
+
+    def set_pixel(self, data):
+        key = data.get('key', None)
+        if key is not None and not isinstance(key, str):
+            raise ValueError("Expected a string key, got {!r}".format(key))
+        rgb = data.get('rgb', (0, 0, 0))
+        # check the colour before the key is given a position
+        colour_bytes(rgb)
+        return self.set_position(self.slots.get_position(key), rgb)
+
+    def set_multiple_pixels(self, data):
+        pixels = data.get('pixels', [])
+        if not isinstance(pixels, list):
+            raise ValueError("Expected a list of pixels")
+        changed = False
+        for pixel in pixels:
+            try:
+                if not isinstance(pixel, dict):
+                    raise ValueError("Expected a pixel, got {!r}".format(
+                        pixel))
+                changed = self.set_pixel(pixel) or changed
+            except ValueError as e:
+                print("Ignoring pixel: {}".format(e))
+        return changed
+
+    def delete_pixel(self, data):
+        changed = False
+        for key in messaging.deleted_keys(data):
+            if key is not None and not isinstance(key, str):
+                continue
+            position = self.slots.release(key)
+            if position is not None:
+                changed = self.set_position(position, (0, 0, 0)) or changed
+        return changed
+
+    def set_all_pixels(self, data):
+        return self.framebuffer.fill(data.get('rgb', (0, 0, 0)))
+
+    def handle_message(self, message):
+        topic, data = message.topic, message.data
+        if not isinstance(data, dict):
+            print("Ignoring {} message: data is not an object".format(topic))
+            return
+        changed = False
+        try:
+            if topic == 'paas_pixel':
+                changed = self.set_pixel(data)
+            elif topic == 'paas_multipixel':
+                changed = self.set_multiple_pixels(data)
+            elif topic == 'paas_allpixels':
+                changed = self.set_all_pixels(data)
+            elif topic == 'paas_deletepixel':
+                changed = self.delete_pixel(data)
+        except ValueError as e:
+            print("Ignoring {} message: {}".format(topic, e))
+
+        if changed:
+            self.scheduler.mark_dirty()
+        if topic == 'paas_showpixels' or data.get('show', True):
+            self.scheduler.request_show()
+        if message.trace is not None:
+            self.scheduler.add_trace(message.trace)
+
+    def run(self, subsocket, context=None, topic_filter='paas_', stop=None):
+        """Show what is published on the subscriber socket until the stop
+        event, if any, is set.
+
+        Given the context, the display starts from the core's latest state
+        rather than a blank framebuffer, and fetches it again whenever
+        messages are found to be missing.
+        """
+        after = None
+        if context is not None:
+            after, snapshot = messaging.fetch_snapshot(context, topic_filter)
+            for message in snapshot:
+                self.handle_message(message)
+        while stop is None or not stop.is_set():
+            if context is not None and messaging.sequence_tracker.resync:
+                # messages were dropped; catch up with the core's state
+                seq, snapshot = messaging.resync(
+                    context, topic_filter, list(self.slots.keymap))
+                if seq is not None:
+                    after = seq
+                for message in snapshot:
+                    self.handle_message(message)
+            timeout = self.scheduler.timeout()
+            if stop is not None:
+                # wake up now and then to notice being stopped
+                timeout = 100 if timeout is None else min(timeout, 100)
+            if subsocket.poll(timeout):
+                for message in messaging.drain_messages(
+                        subsocket, self.scheduler.due, after):
+                    self.handle_message(message)
+            self.scheduler.present(self.update_display)
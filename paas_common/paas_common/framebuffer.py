@@ -0,0 +1,137 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""The framebuffer that the displays render from.
+
+Pixels are held as packed r, g, b bytes in a single bytearray, row by
+row, so that whole-display and region operations are slice assignments
+and colour blending is a byte translation rather than a loop over pixels
+in python. A strip of LEDs is a framebuffer with a height of one.
+
+The methods that modify the framebuffer return whether anything actually
+changed so that the displays can avoid needless refreshes. Colour
+components are clamped to 0-255, with fractions dropped; anything else
+that is not an r, g, b colour raises ValueError.
+"""
+
+
+def colour_bytes(rgb):
+    if not isinstance(rgb, (list, tuple, bytes, bytearray)):
+        raise ValueError("Expected an r, g, b colour, got {!r}".format(rgb))
+    try:
+        colour = bytes(rgb)
+    except (TypeError, ValueError):
+        try:
+            colour = bytes(min(max(int(c), 0), 255) for c in rgb)
+        except (TypeError, ValueError):
+            raise ValueError(
+                "Expected an r, g, b colour, got {!r}".format(rgb))
+    if len(colour) != 3:
+        raise ValueError("Expected an r, g, b colour, got {!r}".format(rgb))
+    return colour
+
+
+class FrameBuffer(object):
+
+    def __init__(self, width, height=1):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(width * height * 3)
+
+    def __len__(self):
+        return self.width * self.height
+
+    def offset(self, x, y=0):
+        return (y * self.width + x) * 3
+
+    def get_pixel(self, x, y=0):
+        offset = self.offset(x, y)
+        return tuple(self.pixels[offset:offset + 3])
+
+    def set_pixel(self, x, y, rgb):
+        colour = colour_bytes(rgb)
+        offset = self.offset(x, y)
+        if self.pixels[offset:offset + 3] == colour:
+            return False
+        self.pixels[offset:offset + 3] = colour
+        return True
+
+    def fill(self, rgb):
+        frame = colour_bytes(rgb) * len(self)
+        if self.pixels == frame:
+            return False
+        self.pixels[:] = frame
+        return True
+
+    def fill_region(self, x, y, width, height, rgb):
+        """Fill the width by height region with its top left at x, y,
+        clipped to the framebuffer."""
+        x0, x1 = max(x, 0), min(x + width, self.width)
+        y0, y1 = max(y, 0), min(y + height, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return False
+        row = colour_bytes(rgb) * (x1 - x0)
+        changed = False
+        for j in range(y0, y1):
+            start = self.offset(x0, j)
+            if self.pixels[start:start + len(row)] != row:
+                self.pixels[start:start + len(row)] = row
+                changed = True
+        return changed
+
+    def blit(self, source, x=0, y=0):
+        """Copy another framebuffer into this one with its top left at
+        x, y, clipped to this framebuffer."""
+        x0, x1 = max(x, 0), min(x + source.width, self.width)
+        y0, y1 = max(y, 0), min(y + source.height, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return False
+        length = (x1 - x0) * 3
+        changed = False
+        for j in range(y0, y1):
+            src = source.offset(x0 - x, j - y)
+            row = source.pixels[src:src + length]
+            start = self.offset(x0, j)
+            if self.pixels[start:start + length] != row:
+                self.pixels[start:start + length] = row
+                changed = True
+        return changed
+
+    def blend(self, rgb, alpha):
+        """Blend every pixel towards the colour, alpha being the weight of
+        the colour from 0.0 (no change) to 1.0 (fill)."""
+        alpha = min(max(alpha, 0.0), 1.0)
+        before = bytes(self.pixels)
+        for channel, target in enumerate(colour_bytes(rgb)):
+            table = bytes(int(round(c + (target - c) * alpha))
+                          for c in range(256))
+            self.pixels[channel::3] = self.pixels[channel::3].translate(table)
+        return self.pixels != before
+
+    def copy(self):
+        duplicate = FrameBuffer(self.width, self.height)
+        duplicate.pixels[:] = self.pixels
+        return duplicate
+
+    def changed_pixels(self, other):
+        """Yield x, y and colour for each pixel that differs from the
+        other framebuffer of the same size."""
+        if self.pixels == other.pixels:
+            return
+        mine, theirs = memoryview(self.pixels), memoryview(other.pixels)
+        for i in range(len(self)):
+            offset = i * 3
+            if mine[offset:offset + 3] != theirs[offset:offset + 3]:
+                y, x = divmod(i, self.width)
+                yield x, y, tuple(mine[offset:offset + 3])
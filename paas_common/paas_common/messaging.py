@@ -0,0 +1,483 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Helpers for sending data into the core and reading what it publishes.
+
+Messages travel as three or four frames:
+
+  topic    the topic as utf-8, so that subscriptions filter on it alone
+  header   wire version, payload encoding and flags, one byte each,
+           followed by the core's sequence numbers, across all topics
+           and within the message's topic, as unsigned 64 bit integers
+           when the sequenced flag is set
+  payload  the data, encoded as described by the header
+  trace    only present when the header says the message is traced; see
+           paas_common.tracing
+
+Pixel data ('key'/'rgb' pairs with an optional 'show') is packed into a
+compact binary payload; anything else is sent as json. The core only
+looks at the header, passing the payload through without decoding it.
+
+The core accepts data on a ROUTER socket so that plain REQ clients keep
+working while DEALER clients may have many messages in flight at once.
+A DEALER client can ask the core not to acknowledge its messages at all,
+in which case it never has to wait on the core.
+
+The core numbers every message it publishes and keeps the latest state of
+the pixels, which it serves as a snapshot on a separate socket. A
+subscriber that has just started can subscribe, fetch the snapshot with
+fetch_snapshot and then ignore any published message numbered at or
+before the snapshot. Gaps in the numbering within a topic show where
+messages were dropped on the way to a subscriber, usually because it fell
+so far behind that the core's send queue for it filled up; these are
+counted by sequence_tracker as messages are read, and resync fetches a
+fresh snapshot to catch up with what was missed.
+"""
+
+import json
+import struct
+import zmq
+from paas_common import settings, tracing
+
+try:
+    SNAPSHOT_TIMEOUT = settings.snapshot_timeout
+except AttributeError:
+    SNAPSHOT_TIMEOUT = 1000
+
+try:
+    RECEIVE_HWM = settings.subscriber_receive_hwm
+except AttributeError:
+    RECEIVE_HWM = 1000
+
+WIRE_VERSION = 1
+
+ENCODING_JSON = 0
+ENCODING_PIXELS = 1
+
+# header flags
+FLAG_NO_ACK = 0x01
+FLAG_TRACED = 0x02
+FLAG_SEQUENCED = 0x04
+
+HEADER = struct.Struct('!BBB')
+SEQUENCE = struct.Struct('!Q')
+SEQUENCES = struct.Struct('!QQ')
+
+# binary pixel payloads: flags and pixel count, then for each pixel the
+# length of its key, the key and its rgb value
+PIXELS_SHOW_SET = 0x01
+PIXELS_SHOW = 0x02
+PIXELS_LIST = 0x04
+PIXELS_HEADER = struct.Struct('!BH')
+RGB = struct.Struct('!BBB')
+
+PIXEL_LIST_TOPICS = ('paas_multipixel',)
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+class Message(object):
+    """A message as read from the pubsub socket."""
+
+    def __init__(self, topic, data, trace=None, seq=None, topic_seq=None):
+        self.topic = topic
+        self.data = data
+        self.trace = trace
+        self.seq = seq
+        self.topic_seq = topic_seq
+
+
+def deleted_keys(data):
+    """Return the keys removed by a paas_deletepixel message, which names
+    either a single 'key' or a list of 'keys'."""
+    keys = data.get('keys')
+    if isinstance(keys, list):
+        return [key for key in keys if isinstance(key, str)]
+    return [data.get('key')]
+
+
+def _packable_pixel(pixel, allowed=('key', 'rgb')):
+    if not isinstance(pixel, dict) or not set(pixel) <= set(allowed):
+        return False
+    key = pixel.get('key')
+    if key is not None and (not isinstance(key, str) or
+                            not 0 < len(key.encode('utf-8')) < 256):
+        return False
+    rgb = pixel.get('rgb')
+    return (isinstance(rgb, (list, tuple)) and len(rgb) == 3 and
+            all(isinstance(c, int) and 0 <= c < 256 for c in rgb))
+
+
+def _pack_pixels(pixels, flags):
+    payload = bytearray(PIXELS_HEADER.pack(flags, len(pixels)))
+    for pixel in pixels:
+        key = pixel.get('key')
+        key = b'' if key is None else key.encode('utf-8')
+        payload.append(len(key))
+        payload += key
+        payload += RGB.pack(*pixel['rgb'])
+    return bytes(payload)
+
+
+def encode_pixels(topic, data):
+    """Return the binary encoding of the pixel data, or None if it
+    cannot be represented that way."""
+    if not isinstance(data, dict) or not isinstance(data.get('show', True),
+                                                    bool):
+        return None
+    flags = 0
+    if 'show' in data:
+        flags |= PIXELS_SHOW_SET | (PIXELS_SHOW if data['show'] else 0)
+
+    if topic in PIXEL_LIST_TOPICS:
+        pixels = data.get('pixels')
+        if (not set(data) <= {'pixels', 'show'} or
+                not isinstance(pixels, list) or len(pixels) > 0xffff or
+                not all(_packable_pixel(p) for p in pixels)):
+            return None
+        return _pack_pixels(pixels, flags | PIXELS_LIST)
+
+    if not _packable_pixel(data, ('key', 'rgb', 'show')):
+        return None
+    return _pack_pixels([data], flags)
+
+
+def decode_pixels(payload):
+    try:
+        flags, count = PIXELS_HEADER.unpack_from(payload)
+        offset = PIXELS_HEADER.size
+        pixels = []
+        for _ in range(count):
+            keylen = payload[offset]
+            offset += 1
+            pixel = {}
+            if keylen:
+                pixel['key'] = bytes(
+                    payload[offset:offset + keylen]).decode('utf-8')
+                offset += keylen
+            pixel['rgb'] = list(RGB.unpack_from(payload, offset))
+            offset += RGB.size
+            pixels.append(pixel)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise WireFormatError("Malformed pixel payload: {}".format(e))
+
+    if flags & PIXELS_LIST:
+        data = {'pixels': pixels}
+    elif count == 1:
+        data = pixels[0]
+    else:
+        raise WireFormatError("Expected a single pixel, found {}".format(
+            count))
+    if flags & PIXELS_SHOW_SET:
+        data['show'] = bool(flags & PIXELS_SHOW)
+    return data
+
+
+def encode_message(topic, data, flags=0):
+    """Return the frames for publishing data on the topic."""
+    payload = encode_pixels(topic, data)
+    if payload is None:
+        encoding = ENCODING_JSON
+        payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    else:
+        encoding = ENCODING_PIXELS
+    header = HEADER.pack(WIRE_VERSION, encoding, flags)
+    return [topic.encode('utf-8'), header, payload]
+
+
+def read_header(header):
+    if len(header) < HEADER.size:
+        raise WireFormatError("Short message header")
+    version, encoding, flags = HEADER.unpack_from(header)
+    if version != WIRE_VERSION:
+        raise WireFormatError("Unsupported wire version {}".format(version))
+    return encoding, flags
+
+
+def sequence_header(header, seq, topic_seq):
+    """Return the header with the core's sequence numbers added."""
+    version, encoding, flags = HEADER.unpack_from(header)
+    return (HEADER.pack(version, encoding, flags | FLAG_SEQUENCED) +
+            SEQUENCES.pack(seq, topic_seq))
+
+
+def read_sequence(header):
+    """Return the sequence numbers in the header, across all topics and
+    within the topic, or None and None."""
+    _, _, flags = HEADER.unpack_from(header)
+    if flags & FLAG_SEQUENCED and len(header) >= HEADER.size + SEQUENCES.size:
+        return SEQUENCES.unpack_from(header, HEADER.size)
+    return None, None
+
+
+def decode_message(frames):
+    """Return the Message held in frames from the pubsub socket."""
+    if len(frames) not in (3, 4):
+        raise WireFormatError("Expected 3 or 4 frames, found {}".format(
+            len(frames)))
+    topic, header, payload = frames[:3]
+    encoding, flags = read_header(header)
+    trace = None
+    if flags & FLAG_TRACED and len(frames) == 4:
+        trace = tracing.stamp(frames[3], tracing.SUBSCRIBER_RECEIVE)
+    try:
+        if encoding == ENCODING_PIXELS:
+            data = decode_pixels(payload)
+        elif encoding == ENCODING_JSON:
+            data = json.loads(bytes(payload).decode('utf-8'))
+        else:
+            raise WireFormatError(
+                "Unknown payload encoding {}".format(encoding))
+        topic = bytes(topic).decode('utf-8')
+    except WireFormatError:
+        raise
+    except ValueError as e:
+        # bad json or utf-8
+        raise WireFormatError("Malformed payload: {}".format(e))
+    return Message(topic, data, trace, *read_sequence(header))
+
+
+class SequenceTracker(object):
+    """Counts the messages missed by a subscriber from the gaps in the
+    numbering of each topic it receives, and sets resync when it finds
+    one.
+
+    The core numbers the messages on each topic from one, so a topic's
+    numbering going backwards means that the core has restarted, as does
+    the overall numbering going backwards when the restarted core's clock
+    is behind. resync is set then too, since the subscriber's state and
+    the sequence number of its last snapshot belong to the old core.
+    """
+
+    def __init__(self):
+        self.last = {}
+        self.last_seq = None
+        self.received = 0
+        self.dropped = 0
+        self.gaps = 0
+        # the most messages found waiting in one go
+        self.lag = 0
+        self.resync = False
+
+    def check(self, message):
+        if message.topic_seq is None:
+            return
+        self.received += 1
+        last = self.last.get(message.topic)
+        if (last is not None and message.topic_seq <= last or
+                self.last_seq is not None and message.seq <= self.last_seq):
+            self.last.clear()
+            self.resync = True
+        elif last is not None and message.topic_seq > last + 1:
+            self.dropped += message.topic_seq - last - 1
+            self.gaps += 1
+            self.resync = True
+        self.last[message.topic] = message.topic_seq
+        self.last_seq = message.seq
+
+    def waiting(self, count):
+        self.lag = max(self.lag, count)
+
+    def report(self):
+        return "received={} dropped={} gaps={} lag={}".format(
+            self.received, self.dropped, self.gaps, self.lag)
+
+
+sequence_tracker = SequenceTracker()
+
+
+def connect_subscriber(context, topic_filter='', port=None):
+    """Return a SUB socket subscribed to the topic_filter on the core's
+    pubsub socket, or on port if given."""
+    subsocket = context.socket(zmq.SUB)
+    subsocket.setsockopt(zmq.RCVHWM, RECEIVE_HWM)
+    subsocket.connect(port or settings.pubSubPort)
+    subsocket.setsockopt_string(zmq.SUBSCRIBE, topic_filter)
+    return subsocket
+
+
+def recv_message(subsocket, flags=0):
+    message = decode_message(subsocket.recv_multipart(flags))
+    sequence_tracker.check(message)
+    return message
+
+
+def drain_messages(subsocket, stop=None, after=None):
+    """Yield the messages already waiting on the socket without blocking,
+    finishing early once stop() returns True. Malformed messages are
+    reported and skipped, as are those numbered at or before after."""
+    count = 0
+    try:
+        while stop is None or not stop():
+            try:
+                frames = subsocket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            count += 1
+            try:
+                message = decode_message(frames)
+            except WireFormatError as e:
+                print("Ignoring message: {}".format(e))
+                continue
+            sequence_tracker.check(message)
+            if after is None or message.seq is None or message.seq > after:
+                yield message
+    finally:
+        sequence_tracker.waiting(count)
+
+
+def fetch_snapshot(context, prefix='', timeout=SNAPSHOT_TIMEOUT):
+    """Fetch the core's latest state for topics starting with prefix.
+
+    Returns the sequence number the snapshot is up to date with and the
+    messages that recreate the state, or None and no messages if the
+    core does not answer within timeout milliseconds. Subscribe before
+    fetching so that nothing published in between is missed.
+    """
+    sock = context.socket(zmq.REQ)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect(settings.snapshotPort)
+    try:
+        sock.send_string(prefix)
+        if not sock.poll(timeout):
+            return None, []
+        frames = sock.recv_multipart()
+    finally:
+        sock.close()
+    seq = SEQUENCE.unpack(frames[0])[0]
+    messages = []
+    for i in range(1, len(frames) - 2, 3):
+        try:
+            messages.append(decode_message(frames[i:i + 3]))
+        except WireFormatError as e:
+            print("Ignoring snapshot message: {}".format(e))
+    return seq, messages
+
+
+def resync(context, prefix='', known_keys=()):
+    """Fetch a fresh snapshot once sequence_tracker has found messages
+    missing, returning it as fetch_snapshot does. If the core does not
+    answer, the fetch is tried again next time.
+
+    Keys may have been deleted while messages were being missed, so a
+    paas_deletepixel message for those in known_keys that the snapshot
+    no longer lists is put before the snapshot's own messages.
+    """
+    seq, messages = fetch_snapshot(context, prefix)
+    if seq is None:
+        return seq, messages
+    sequence_tracker.resync = False
+    # without its pixels the snapshot cannot tell what was deleted
+    if 'paas_multipixel'.startswith(prefix):
+        live = set()
+        for message in messages:
+            if message.topic == 'paas_multipixel':
+                live.update(pixel.get('key')
+                            for pixel in message.data.get('pixels', []))
+        stale = [key for key in known_keys
+                 if isinstance(key, str) and key not in live]
+        if stale:
+            messages.insert(0, Message('paas_deletepixel', {'keys': stale}))
+    return seq, messages
+
+
+def read_ingest(frames):
+    """Read a message sent to the core's ROUTER socket.
+
+    Returns the reply envelope, the frames to publish and whether an
+    acknowledgement was requested, or None if the message is not
+    understood. Messages in the older single frame json form from REQ
+    clients are converted to the current wire format. A message with a
+    body that cannot be read is acknowledged with nothing to publish, so
+    that a REQ client waiting on its reply is not left blocked.
+    """
+    if b'' not in frames:
+        return None
+    delimiter = frames.index(b'')
+    envelope = frames[:delimiter + 1]
+    body = frames[delimiter + 1:]
+
+    if len(body) == 1:
+        try:
+            data = json.loads(body[0].decode('utf-8'))
+            if isinstance(data, str):
+                # REQ clients send a json encoded string of json
+                data = json.loads(data)
+        except ValueError:
+            return envelope, None, True
+        if not isinstance(data, dict) or not isinstance(
+                data.get('topic', ''), str):
+            return envelope, None, True
+        return (envelope,
+                encode_message(data.get('topic', ''), data.get('data', '')),
+                data.get('ack', True))
+
+    if len(body) not in (3, 4):
+        return None
+    try:
+        encoding, flags = read_header(body[1])
+    except WireFormatError:
+        return envelope, None, True
+    if len(body) == 4:
+        body[3] = tracing.stamp(body[3], tracing.CORE_RECEIVE)
+    return envelope, body, not flags & FLAG_NO_ACK
+
+
+def ack_replies(acks):
+    """Yield the reply frames acknowledging a batch of ingested messages.
+
+    acks maps each client to its reply envelope and the list of topics of
+    its messages in the batch; each client gets a single reply.
+    """
+    for envelope, topics in acks.values():
+        if len(topics) == 1:
+            text = "Received message on topic '{}'".format(topics[0])
+        else:
+            text = "Received {} messages".format(len(topics))
+        returnmsg = {"message": text, "count": len(topics)}
+        # REQ clients expect a json encoded string of json
+        reply = json.dumps(json.dumps(returnmsg)).encode('utf-8')
+        yield envelope + [reply]
+
+
+def connect_sender(context):
+    """Return a DEALER socket connected to the core's injection point."""
+    sender = context.socket(zmq.DEALER)
+    sender.connect(settings.dataInputPort)
+    return sender
+
+
+def send_data(sender, topic, data, ack=False):
+    """Send data on the topic through a sender from connect_sender.
+
+    When ack is True the core will reply; the caller is then responsible
+    for reading the replies, which may acknowledge several messages at
+    once, with receive_ack.
+    """
+    flags = 0 if ack else FLAG_NO_ACK
+    if tracing.TRACE_ENABLED:
+        frames = encode_message(topic, data, flags | FLAG_TRACED)
+        frames.append(tracing.stamp(b'', tracing.PRODUCER_SEND))
+    else:
+        frames = encode_message(topic, data, flags)
+    sender.send_multipart([b''] + frames)
+
+
+def receive_ack(sender):
+    """Wait for the next acknowledgement and return how many messages it
+    covers."""
+    *envelope, reply = sender.recv_multipart()
+    return json.loads(json.loads(reply.decode('utf-8'))).get('count', 1)
@@ -0,0 +1,89 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Frame rate control shared by the displays.
+
+Updates mark the display dirty and messages asking for the display to be
+shown request a present. Requests are honoured at most once per frame
+interval, so a burst of updates is coalesced into a single refresh, and
+the refresh is skipped entirely when nothing changed since the last one.
+"""
+
+from collections import deque
+import math
+import time
+from paas_common import settings, tracing
+
+try:
+    DISPLAY_FPS = settings.display_fps
+except AttributeError:
+    DISPLAY_FPS = 30
+
+# traces held for the next present; beyond this the oldest are dropped
+MAX_PENDING_TRACES = 1000
+
+
+class RenderScheduler(object):
+
+    def __init__(self, fps=DISPLAY_FPS, clock=time.monotonic):
+        self.interval = 1.0 / fps if fps else 0.0
+        self.clock = clock
+        self.dirty = False
+        self.requested = False
+        self.last_present = float('-inf')
+        self.traces = deque(maxlen=MAX_PENDING_TRACES)
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def request_show(self):
+        self.requested = True
+
+    def add_trace(self, trace):
+        """Record the trace of a message when the display is next shown."""
+        self.traces.append(trace)
+
+    def next_present(self):
+        return self.last_present + self.interval
+
+    def due(self):
+        return self.requested and self.clock() >= self.next_present()
+
+    def timeout(self):
+        """Return how many milliseconds to wait for further messages
+        before the next present, or None to wait indefinitely."""
+        if not self.requested:
+            return None
+        wait = max(0.0, self.next_present() - self.clock())
+        return int(math.ceil(wait * 1000))
+
+    def present(self, show):
+        """Call show if a present is due and the display has changed.
+
+        Returns True if show was called."""
+        if not self.due():
+            return False
+        self.requested = False
+        shown = self.dirty
+        if shown:
+            show()
+            self.dirty = False
+            self.last_present = self.clock()
+            now = time.time()
+            for trace in self.traces:
+                tracing.tracer.record(
+                    tracing.stamp(trace, tracing.RENDER, now))
+        # messages that changed nothing were never rendered
+        self.traces.clear()
+        return shown
@@ -13,9 +13,73 @@
 #  limitations under the License.
 
 """This file contains common settings so that the different processes can
-know what sockets to connect to."""
+know what sockets to connect to.
 
-pubSubPort = 'ipc:///tmp/0mq/data.ipc'
-dataInputPort = 'ipc:///tmp/0mq/inputdata.ipc'
-dbPort = 'ipc:///tmp/0mq/db.ipc'
+The socket addresses come from a profile chosen with the PAAS_PROFILE
+environment variable:
+
+  ipc     the default; every process on one host, talking over unix sockets
+  tcp     processes on several hosts; PAAS_HOST names the host of the core
+          and database (0.0.0.0 on that host itself, so they bind to every
+          interface)
+
+Settings can then be overridden from a python file named by PAAS_SETTINGS,
+and finally by environment variables named PAAS_ and the setting's name
+in upper case, e.g. PAAS_PUBSUBPORT=tcp://display-hub:5560. Environment
+values are read as json where possible, so PAAS_TRACE_MESSAGES=true gives
+True, and as plain strings otherwise.
+"""
+
+import json
+import os
+
+PAAS_HOST = os.environ.get('PAAS_HOST', '127.0.0.1')
+
+PROFILES = {
+    'ipc': {
+        'pubSubPort': 'ipc:///tmp/0mq/data.ipc',
+        'dataInputPort': 'ipc:///tmp/0mq/inputdata.ipc',
+        'dbPort': 'ipc:///tmp/0mq/db.ipc',
+        'snapshotPort': 'ipc:///tmp/0mq/snapshot.ipc',
+    },
+    'tcp': {
+        'pubSubPort': 'tcp://{}:5556'.format(PAAS_HOST),
+        'dataInputPort': 'tcp://{}:5555'.format(PAAS_HOST),
+        'dbPort': 'tcp://{}:5557'.format(PAAS_HOST),
+        'snapshotPort': 'tcp://{}:5558'.format(PAAS_HOST),
+    },
+}
+
+PROFILE = os.environ.get('PAAS_PROFILE', 'ipc')
+
+pubSubPort = PROFILES[PROFILE]['pubSubPort']
+dataInputPort = PROFILES[PROFILE]['dataInputPort']
+dbPort = PROFILES[PROFILE]['dbPort']
+snapshotPort = PROFILES[PROFILE]['snapshotPort']
 dbFile = '/tmp/0mq/db'
+
+
+def _load_settings_file(path):
+    with open(path) as f:
+        code = compile(f.read(), path, 'exec')
+    exec(code, globals())
+
+
+def _read_environment(environ):
+    names = {name.upper(): name for name in globals()
+             if not name.startswith('_')}
+    for variable, value in environ.items():
+        if not variable.startswith('PAAS_') or variable in (
+                'PAAS_HOST', 'PAAS_PROFILE', 'PAAS_SETTINGS'):
+            continue
+        name = variable[5:]
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        globals()[names.get(name, name.lower())] = value
+
+
+if os.environ.get('PAAS_SETTINGS'):
+    _load_settings_file(os.environ['PAAS_SETTINGS'])
+_read_environment(os.environ)
@@ -0,0 +1,195 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Optional tracing of messages through the stages of the pipeline.
+
+When trace_messages is set, producers add a trace frame to each message
+and every process it passes through appends a timestamp for its stage.
+Each process keeps rolling histograms of the time spent between stages,
+which it prints when sent SIGUSR1 along with any other reports it has.
+
+Timestamps are wall clock times, so intervals between processes on
+different hosts are only as good as the clocks are synchronised.
+"""
+
+import bisect
+import signal
+import struct
+import time
+from paas_common import settings
+
+try:
+    TRACE_ENABLED = settings.trace_messages
+except AttributeError:
+    TRACE_ENABLED = False
+
+try:
+    HISTOGRAM_WINDOW = settings.trace_histogram_window
+except AttributeError:
+    HISTOGRAM_WINDOW = 300
+
+PRODUCER_SEND = 1
+CORE_RECEIVE = 2
+CORE_PUBLISH = 3
+SUBSCRIBER_RECEIVE = 4
+RENDER = 5
+
+STAGE_NAMES = {
+    PRODUCER_SEND: 'producer_send',
+    CORE_RECEIVE: 'core_receive',
+    CORE_PUBLISH: 'core_publish',
+    SUBSCRIBER_RECEIVE: 'subscriber_receive',
+    RENDER: 'render',
+}
+
+STAMP = struct.Struct('!Bd')
+
+# bucket upper bounds from 10us to a couple of minutes, four per doubling
+BUCKET_BOUNDS = [1e-5 * 2 ** (i / 4.0) for i in range(96)]
+
+
+def stamp(trace, stage, when=None):
+    """Return the trace frame with a timestamp for the stage appended."""
+    return bytes(trace) + STAMP.pack(stage, time.time() if when is None
+                                     else when)
+
+
+def read_trace(trace):
+    """Return the stage and time of each stamp in a trace frame."""
+    trace = bytes(trace)
+    return [STAMP.unpack_from(trace, offset)
+            for offset in range(0, len(trace) - STAMP.size + 1, STAMP.size)]
+
+
+class LatencyHistogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.total += 1
+        self.maximum = max(self.maximum, seconds)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding the percentile."""
+        if not self.total:
+            return None
+        wanted = fraction * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                if i < len(BUCKET_BOUNDS):
+                    return min(BUCKET_BOUNDS[i], self.maximum)
+                return self.maximum
+        return self.maximum
+
+
+class RollingHistogram(object):
+    """A histogram over roughly the last one to two windows of seconds."""
+
+    def __init__(self, window=HISTOGRAM_WINDOW, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.current = LatencyHistogram()
+        self.previous = LatencyHistogram()
+        self.started = clock()
+
+    def _roll(self):
+        now = self.clock()
+        if now - self.started >= self.window:
+            # after a long quiet spell the previous window is stale too
+            stale = now - self.started >= 2 * self.window
+            self.previous = LatencyHistogram() if stale else self.current
+            self.current = LatencyHistogram()
+            self.started = now
+
+    def record(self, seconds):
+        self._roll()
+        self.current.record(seconds)
+
+    def snapshot(self):
+        self._roll()
+        histogram = LatencyHistogram()
+        histogram.merge(self.previous)
+        histogram.merge(self.current)
+        return histogram
+
+
+class Tracer(object):
+    """Collects the stage to stage latencies of the traces seen by this
+    process."""
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.window = window
+        self.histograms = {}
+
+    def record_interval(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RollingHistogram(self.window)
+        histogram.record(seconds)
+
+    def record(self, trace):
+        stamps = read_trace(trace)
+        for (stage_from, start), (stage_to, end) in zip(stamps, stamps[1:]):
+            self.record_interval('{} -> {}'.format(
+                STAGE_NAMES.get(stage_from, stage_from),
+                STAGE_NAMES.get(stage_to, stage_to)), end - start)
+        if len(stamps) > 2:
+            self.record_interval('total {} -> {}'.format(
+                STAGE_NAMES.get(stamps[0][0], stamps[0][0]),
+                STAGE_NAMES.get(stamps[-1][0], stamps[-1][0])),
+                stamps[-1][1] - stamps[0][1])
+
+    def report(self):
+        lines = []
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name].snapshot()
+            if not histogram.total:
+                continue
+            lines.append(
+                "{}: n={} p50={:.3f}ms p99={:.3f}ms max={:.3f}ms".format(
+                    name, histogram.total,
+                    histogram.percentile(0.5) * 1000,
+                    histogram.percentile(0.99) * 1000,
+                    histogram.maximum * 1000))
+        return '\n'.join(lines) or 'No traced messages seen'
+
+
+tracer = Tracer()
+
+
+def report_on_signal(*reports):
+    """Print this process's latency report, if tracing, and the text from
+    each of the reports functions whenever it receives SIGUSR1."""
+    if not (TRACE_ENABLED or reports) or not hasattr(signal, 'SIGUSR1'):
+        return
+
+    def handler(signum, frame):
+        if TRACE_ENABLED:
+            print(tracer.report(), flush=True)
+        for report in reports:
+            print(report(), flush=True)
+
+    signal.signal(signal.SIGUSR1, handler)
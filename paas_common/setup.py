@@ -15,6 +15,10 @@
 from setuptools import setup
 
 
+requires = (
+    'pyzmq',
+)
+
 setup(
     name='paas_common',
     version='0.2.0-SNAPSHOT',
@@ -22,6 +26,7 @@ setup(
     author='Gary Martin',
     author_email='gary.martin@physics.org',
     url='https://github.com/garym/PixelsAAS',
+    install_requires=requires,
     packages=(
         'paas_common',
     ),
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""An asyncio implementation of the core, with the same sockets and
+behaviour as paas_core.core.
+
+Each ingest socket is served by its own task, which reads messages in
+batches, acknowledges them as paas_core.core does and puts the frames to
+publish on a bounded queue. A single publish task sends them on from the
+queue, so a slow publisher makes the ingest tasks wait rather than
+letting the queue grow without limit. Snapshots of the last value cache
+are served by another task, and housekeeping tasks run alongside on the
+same event loop.
+
+With core_conflate set, everything waiting on the queue is collapsed by
+a paas_core.conflate.Conflator each time the publish task takes from it,
+and core_send_hwm limits what may queue for each subscriber, as in
+paas_core.core.
+
+Besides settings.dataInputPort, messages are accepted on any ports listed
+in settings.extra_input_ports.
+"""
+
+import asyncio
+from collections import defaultdict, OrderedDict
+import itertools
+import os
+import os.path
+import time
+import zmq
+import zmq.asyncio
+from paas_common import messaging, settings, tracing
+from paas_core.conflate import Conflator
+from paas_core.lastvalue import LastValueCache
+
+try:
+    INGEST_BATCH_SIZE = settings.ingest_batch_size
+except AttributeError:
+    INGEST_BATCH_SIZE = 256
+
+try:
+    EXTRA_INPUT_PORTS = settings.extra_input_ports
+except AttributeError:
+    EXTRA_INPUT_PORTS = ()
+
+try:
+    PUBLISH_QUEUE_SIZE = settings.core_publish_queue_size
+except AttributeError:
+    PUBLISH_QUEUE_SIZE = 10000
+
+try:
+    CONFLATE = settings.core_conflate
+except AttributeError:
+    CONFLATE = False
+
+try:
+    SEND_HWM = settings.core_send_hwm
+except AttributeError:
+    SEND_HWM = 1000
+
+try:
+    STATS_INTERVAL = settings.core_stats_interval
+except AttributeError:
+    STATS_INTERVAL = 60
+
+
+def make_ipc_dir(port):
+    if port.startswith('ipc://'):
+        os.makedirs(os.path.dirname(port[6:]), exist_ok=True)
+
+
+class AsyncCore(object):
+
+    def __init__(self, context, input_ports, pub_port, snapshot_port,
+                 queue_size=PUBLISH_QUEUE_SIZE):
+        for port in list(input_ports) + [pub_port, snapshot_port]:
+            make_ipc_dir(port)
+        self.receivers = []
+        for port in input_ports:
+            receiver = context.socket(zmq.ROUTER)
+            receiver.bind(port)
+            self.receivers.append(receiver)
+        self.pubsocket = context.socket(zmq.PUB)
+        self.pubsocket.setsockopt(zmq.SNDHWM, SEND_HWM)
+        self.pubsocket.bind(pub_port)
+        self.snapshotsocket = context.socket(zmq.ROUTER)
+        self.snapshotsocket.bind(snapshot_port)
+        self.sequence = itertools.count(int(time.time() * 1000000))
+        self.topic_sequences = defaultdict(int)
+        self.cache = LastValueCache(next(self.sequence))
+        self.queue = asyncio.Queue(queue_size)
+        self.conflator = Conflator() if CONFLATE else None
+        self.received = 0
+        self.published = 0
+
+    async def ingest(self, receiver):
+        while True:
+            acks = OrderedDict()
+            flags = 0
+            for _ in range(INGEST_BATCH_SIZE):
+                try:
+                    frames = await receiver.recv_multipart(flags)
+                except zmq.Again:
+                    break
+                # only wait for the first message of each batch
+                flags = zmq.NOBLOCK
+
+                request = messaging.read_ingest(frames)
+                if request is None:
+                    continue
+                self.received += 1
+                envelope, message, ack = request
+                if message is not None:
+                    await self.queue.put(message)
+                    topic = message[0].decode('utf-8', 'replace')
+                else:
+                    topic = ''
+                if ack:
+                    key = tuple(envelope)
+                    acks.setdefault(key, (envelope, []))[1].append(topic)
+            for reply in messaging.ack_replies(acks):
+                await receiver.send_multipart(reply)
+
+    async def publish(self):
+        while True:
+            message = await self.queue.get()
+            if self.conflator is None:
+                await self.publish_message(message)
+                continue
+            self.conflator.add(message)
+            while not self.queue.empty():
+                self.conflator.add(self.queue.get_nowait())
+            for message in self.conflator.drain():
+                await self.publish_message(message)
+
+    async def publish_message(self, message):
+        seq = next(self.sequence)
+        topic = bytes(message[0])
+        self.topic_sequences[topic] += 1
+        message[1] = messaging.sequence_header(
+            message[1], seq, self.topic_sequences[topic])
+        if len(message) == 4:
+            message[3] = tracing.stamp(message[3], tracing.CORE_PUBLISH)
+            tracing.tracer.record(message[3])
+        await self.pubsocket.send_multipart(message)
+        try:
+            self.cache.update(message, seq)
+        except Exception as e:
+            # a message the cache cannot fold must not stop the core
+            print("Not caching message: {}".format(e))
+        self.published += 1
+
+    async def serve_snapshots(self):
+        while True:
+            *envelope, request = await self.snapshotsocket.recv_multipart()
+            await self.snapshotsocket.send_multipart(
+                envelope + self.cache.reply(request))
+
+    async def report_stats(self, interval):
+        last = None
+        while True:
+            await asyncio.sleep(interval)
+            stats = (self.received, self.published)
+            if stats != last:
+                conflated = (self.conflator.conflated
+                             if self.conflator is not None else 0)
+                print("{}: received {}, published {}, conflated {}, "
+                      "{} queued".format(
+                          time.strftime('%Y-%m-%d %H:%M:%S'), self.received,
+                          self.published, conflated, self.queue.qsize()),
+                      flush=True)
+                last = stats
+
+    async def run(self):
+        tasks = [self.publish(), self.serve_snapshots()]
+        tasks.extend(self.ingest(receiver) for receiver in self.receivers)
+        if STATS_INTERVAL:
+            tasks.append(self.report_stats(STATS_INTERVAL))
+        await asyncio.gather(*tasks)
+
+    def close(self):
+        for receiver in self.receivers:
+            receiver.close()
+        self.pubsocket.close()
+        self.snapshotsocket.close()
+
+
+def main():
+    tracing.report_on_signal()
+    context = zmq.asyncio.Context()
+    core = AsyncCore(context,
+                     [settings.dataInputPort] + list(EXTRA_INPUT_PORTS),
+                     settings.pubSubPort, settings.snapshotPort)
+    try:
+        asyncio.run(core.run())
+    except KeyboardInterrupt:
+        print("...\nInterrupt received; cleaning up and exiting.")
+    finally:
+        core.close()
+        context.term()
+
+if __name__ == '__main__':
+    main()
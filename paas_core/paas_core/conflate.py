@@ -0,0 +1,103 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Conflation of the messages waiting to be published.
+
+When the core is set to conflate, each batch of messages is collapsed
+before it is published so that only the latest value of each key is
+sent. A paas_pixel or paas_deletepixel message replaces any waiting
+message for the same key, a paas_allpixels message replaces every
+waiting pixel message other than deletions and only the last
+paas_showpixels is kept. A message that replaces another takes its place
+at the end of the batch, so the order of what is left is unchanged.
+Messages on any other topic are published as they are.
+
+If a message that was replaced asked for the display to be shown and its
+replacement does not, a paas_showpixels message is added to the end of
+the batch so that the request is not lost.
+"""
+
+from collections import OrderedDict
+import itertools
+from paas_common import messaging
+
+ALL_PIXELS = 'all'
+SHOW_PIXELS = 'show'
+
+
+class Conflator(object):
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.conflated = 0
+        self.show_lost = False
+        self._unique = itertools.count()
+
+    @staticmethod
+    def _data(frames):
+        try:
+            encoding, _ = messaging.read_header(frames[1])
+            if encoding == messaging.ENCODING_PIXELS:
+                data = messaging.decode_pixels(frames[2])
+            else:
+                data = messaging.decode_message(frames[:3]).data
+        except (messaging.WireFormatError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _requests_show(self, frames):
+        return (bytes(frames[0]) == b'paas_showpixels' or
+                self._data(frames).get('show', True) is not False)
+
+    def _key(self, frames):
+        topic = bytes(frames[0])
+        if topic == b'paas_allpixels':
+            return ALL_PIXELS
+        if topic == b'paas_showpixels':
+            return SHOW_PIXELS
+        if topic in (b'paas_pixel', b'paas_deletepixel'):
+            key = self._data(frames).get('key')
+            if isinstance(key, str):
+                return ('pixel', key)
+            return ('pixels', next(self._unique))
+        if topic == b'paas_multipixel':
+            return ('pixels', next(self._unique))
+        return next(self._unique)
+
+    def add(self, frames):
+        key = self._key(frames)
+        if key == ALL_PIXELS:
+            # a deletion must still reach subscribers that store pixels
+            superseded = [
+                k for k, f in self.pending.items()
+                if k == ALL_PIXELS or isinstance(k, tuple) and
+                bytes(f[0]) != b'paas_deletepixel']
+        else:
+            superseded = [key] if key in self.pending else []
+        if superseded and not self._requests_show(frames):
+            self.show_lost = self.show_lost or any(
+                self._requests_show(self.pending[k]) for k in superseded)
+        for k in superseded:
+            del self.pending[k]
+        self.conflated += len(superseded)
+        self.pending[key] = frames
+
+    def drain(self):
+        """Return the waiting messages in order and start afresh."""
+        messages = list(self.pending.values())
+        if self.show_lost and next(reversed(self.pending)) != SHOW_PIXELS:
+            messages.append(messaging.encode_message('paas_showpixels', {}))
+        self.pending.clear()
+        self.show_lost = False
+        return messages
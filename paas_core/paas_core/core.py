@@ -16,43 +16,158 @@
 
 """This is the central distribution point of the project. This program acts
 as a server to allow clients to input data that will be re-published to any
-subscibers to the pubsub socket."""
+subscibers to the pubsub socket.
 
+Data is injected on a ROUTER socket. Plain REQ clients get one reply per
+request as before, while DEALER clients may pipeline as many messages as
+they like. Messages waiting on the socket are handled in batches and each
+client gets a single acknowledgement per batch covering all of its
+messages, unless it asked for no acknowledgement.
+
+Messages are published in the multipart format described in
+paas_common.messaging. Only the header is inspected here; the payload is
+forwarded as received.
+
+Each published message is given a sequence number, starting from the
+time in microseconds so that numbers keep going up across restarts, and
+a second number counting the messages on its topic from one. The latest
+state is kept in a paas_core.lastvalue.LastValueCache and served to
+newly started subscribers on the snapshot socket.
+
+With core_conflate set, each batch is collapsed by a
+paas_core.conflate.Conflator before publishing, so that a subscriber
+that falls behind catches up with the latest state rather than every
+step on the way. core_send_hwm sets how many messages may queue for each
+subscriber before the publisher drops them for it.
+"""
+
+from collections import defaultdict, OrderedDict
+import itertools
 import os
 import os.path
+import time
 import zmq
-import json
-from paas_common import settings
+from paas_common import messaging, settings, tracing
+from paas_core.conflate import Conflator
+from paas_core.lastvalue import LastValueCache
 
-for port in (settings.dataInputPort, settings.pubSubPort):
+for port in (settings.dataInputPort, settings.pubSubPort,
+             settings.snapshotPort):
     if port.startswith('ipc://'):
         portdir = os.path.dirname(port[6:])
         os.makedirs(portdir, exist_ok=True)
 
+try:
+    INGEST_BATCH_SIZE = settings.ingest_batch_size
+except AttributeError:
+    INGEST_BATCH_SIZE = 256
+
+try:
+    CONFLATE = settings.core_conflate
+except AttributeError:
+    CONFLATE = False
+
+try:
+    SEND_HWM = settings.core_send_hwm
+except AttributeError:
+    SEND_HWM = 1000
+
 context = zmq.Context()
 
 # receiver is the injection point for external data
-receiver = context.socket(zmq.REP)
+receiver = context.socket(zmq.ROUTER)
 receiver.bind(settings.dataInputPort)
 
 # pubsocket publishes records that are injected to whatever will listen
 pubsocket = context.socket(zmq.PUB)
+pubsocket.setsockopt(zmq.SNDHWM, SEND_HWM)
 pubsocket.bind(settings.pubSubPort)
 
+# snapshotsocket serves the latest state to subscribers that ask
+snapshotsocket = context.socket(zmq.ROUTER)
+snapshotsocket.bind(settings.snapshotPort)
 
-def mainloop():
+poller = zmq.Poller()
+poller.register(receiver, zmq.POLLIN)
+poller.register(snapshotsocket, zmq.POLLIN)
+
+sequence = itertools.count(int(time.time() * 1000000))
+topic_sequences = defaultdict(int)
+cache = LastValueCache(next(sequence))
+conflator = Conflator() if CONFLATE else None
+
+
+def send_acks(acks):
+    for reply in messaging.ack_replies(acks):
+        receiver.send_multipart(reply)
+
+
+def publish(message):
+    seq = next(sequence)
+    topic = bytes(message[0])
+    topic_sequences[topic] += 1
+    message[1] = messaging.sequence_header(
+        message[1], seq, topic_sequences[topic])
+    if len(message) == 4:
+        message[3] = tracing.stamp(message[3], tracing.CORE_PUBLISH)
+        tracing.tracer.record(message[3])
+    pubsocket.send_multipart(message)
+    try:
+        cache.update(message, seq)
+    except Exception as e:
+        # a message the cache cannot fold must not stop the core
+        print("Not caching message: {}".format(e))
+
+
+def ingest_batch():
+    acks = OrderedDict()
+    for _ in range(INGEST_BATCH_SIZE):
+        try:
+            frames = receiver.recv_multipart(zmq.NOBLOCK)
+        except zmq.Again:
+            break
+
+        request = messaging.read_ingest(frames)
+        if request is None:
+            continue
+        envelope, message, ack = request
+        if message is not None:
+            if conflator is not None:
+                conflator.add(message)
+            else:
+                publish(message)
+            topic = message[0].decode('utf-8', 'replace')
+        else:
+            topic = ''
+        if ack:
+            key = tuple(envelope)
+            acks.setdefault(key, (envelope, []))[1].append(topic)
+    if conflator is not None:
+        for message in conflator.drain():
+            publish(message)
+    send_acks(acks)
+
+
+def serve_snapshots():
     while True:
-        jsondata = receiver.recv_json()
-        data = json.loads(jsondata)
+        try:
+            *envelope, request = snapshotsocket.recv_multipart(zmq.NOBLOCK)
+        except zmq.Again:
+            return
+        snapshotsocket.send_multipart(envelope + cache.reply(request))
+
 
-        topic = data.get('topic', '')
-        message = data.get('data', '')
-        pubsocket.send_string("{} {}".format(topic, json.dumps(message)))
-        returnmsg = {"message": "Received message on topic '{}'".format(topic)}
-        receiver.send_json(json.dumps(returnmsg))
+def mainloop():
+    while True:
+        socks = dict(poller.poll())
+        if snapshotsocket in socks:
+            serve_snapshots()
+        if receiver in socks:
+            ingest_batch()
 
 
 def main():
+    tracing.report_on_signal()
     try:
         mainloop()
     except KeyboardInterrupt:
@@ -60,6 +175,7 @@ def main():
     finally:
         pubsocket.close()
         receiver.close()
+        snapshotsocket.close()
         context.term()
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""The core's cache of the latest published state.
+
+Pixel messages are folded into the latest colour of each key, with a
+paas_allpixels message setting every key and the fill for positions
+with no key. For any other topic the last message published on it is
+kept as it was sent. A snapshot recreates the state with a
+paas_allpixels message if one has been seen, one paas_multipixel message
+holding every pixel, a paas_showpixels message and the last message on
+each other topic. Since every live key is listed, a subscriber catching
+up can treat any key missing from the snapshot as deleted.
+
+A snapshot is requested on the core's snapshot socket with a single
+frame holding a topic prefix. The reply is the sequence number of the
+last message published, followed by the topic, header and payload
+frames of each message in the snapshot whose topic has the prefix.
+"""
+
+from collections import OrderedDict
+from paas_common import messaging
+
+PIXEL_TOPICS = ('paas_pixel', 'paas_multipixel', 'paas_allpixels',
+                'paas_deletepixel')
+
+# topics that carry no state of their own
+UNCACHED_TOPICS = ('paas_showpixels',)
+
+
+class LastValueCache(object):
+
+    def __init__(self, seq=0):
+        self.seq = seq
+        self.fill = None
+        self.pixels = OrderedDict()
+        self.topics = OrderedDict()
+
+    def _set_pixel(self, pixel):
+        key = pixel.get('key') if isinstance(pixel, dict) else None
+        if isinstance(key, str):
+            self.pixels.pop(key, None)
+            self.pixels[key] = pixel.get('rgb')
+
+    def update(self, frames, seq):
+        """Fold in a message as published with the sequence number."""
+        self.seq = seq
+        topic = bytes(frames[0]).decode('utf-8', 'replace')
+        if topic in UNCACHED_TOPICS:
+            return
+        try:
+            encoding, _ = messaging.read_header(frames[1])
+            if topic not in PIXEL_TOPICS:
+                header = messaging.HEADER.pack(
+                    messaging.WIRE_VERSION, encoding, 0)
+                self.topics.pop(topic, None)
+                self.topics[topic] = [frames[0], header, frames[2]]
+                return
+            if encoding == messaging.ENCODING_PIXELS:
+                data = messaging.decode_pixels(frames[2])
+            else:
+                data = messaging.decode_message(frames[:3]).data
+        except (messaging.WireFormatError, ValueError) as e:
+            print("Not caching message: {}".format(e))
+            return
+        if not isinstance(data, dict):
+            print("Not caching message: {} data is not an object".format(
+                topic))
+            return
+
+        if topic == 'paas_pixel':
+            self._set_pixel(data)
+        elif topic == 'paas_multipixel':
+            pixels = data.get('pixels', [])
+            for pixel in pixels if isinstance(pixels, list) else []:
+                self._set_pixel(pixel)
+        elif topic == 'paas_allpixels':
+            self.fill = data.get('rgb')
+            for key in self.pixels:
+                self.pixels[key] = self.fill
+        elif topic == 'paas_deletepixel':
+            for key in messaging.deleted_keys(data):
+                if isinstance(key, str):
+                    self.pixels.pop(key, None)
+
+    def snapshot(self, prefix=''):
+        """Return the frames of the messages recreating the state of the
+        topics starting with prefix."""
+        messages = []
+        if self.fill is not None:
+            messages.append(messaging.encode_message(
+                'paas_allpixels', {'rgb': self.fill, 'show': False}))
+        if self.pixels:
+            pixels = [{'key': key, 'rgb': rgb}
+                      for key, rgb in self.pixels.items()]
+            messages.append(messaging.encode_message(
+                'paas_multipixel', {'pixels': pixels, 'show': False}))
+        if messages:
+            messages.append(messaging.encode_message('paas_showpixels', {}))
+        messages.extend(self.topics.values())
+        prefix = prefix.encode('utf-8')
+        return [frames for frames in messages
+                if bytes(frames[0]).startswith(prefix)]
+
+    def reply(self, request):
+        """Return the reply frames to a snapshot request."""
+        prefix = bytes(request).decode('utf-8', 'replace')
+        reply = [messaging.SEQUENCE.pack(self.seq)]
+        for frames in self.snapshot(prefix):
+            reply.extend(frames)
+        return reply
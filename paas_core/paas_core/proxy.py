@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""A forwarding proxy for the core's pubsub socket.
+
+The proxy subscribes to an upstream publisher, the core or another proxy,
+and republishes what it receives on its own downstream socket. The
+subscriptions of its downstream subscribers are passed upstream, so only
+the topics wanted by something downstream of the proxy are sent to it.
+Proxies can be chained, for example one per room, with the displays in
+each room connecting to their room's proxy by setting pubSubPort, and
+with only one connection per room to the core.
+
+The upstream address defaults to settings.pubSubPort and the downstream
+to settings.proxy_downstream_port; both can be given on the command line.
+"""
+
+import argparse
+import os
+import os.path
+import zmq
+from paas_common import settings
+
+try:
+    PROXY_DOWNSTREAM_PORT = settings.proxy_downstream_port
+except AttributeError:
+    PROXY_DOWNSTREAM_PORT = 'tcp://0.0.0.0:5560'
+
+
+def run(context, upstream, downstream):
+    if downstream.startswith('ipc://'):
+        os.makedirs(os.path.dirname(downstream[6:]), exist_ok=True)
+
+    # frontend receives from the upstream publisher
+    frontend = context.socket(zmq.XSUB)
+    frontend.connect(upstream)
+
+    # backend publishes to downstream subscribers, whose subscription
+    # messages zmq.proxy forwards to the frontend
+    backend = context.socket(zmq.XPUB)
+    backend.bind(downstream)
+
+    try:
+        zmq.proxy(frontend, backend)
+    finally:
+        frontend.close()
+        backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--upstream', default=settings.pubSubPort,
+                        help='address of the publisher to subscribe to')
+    parser.add_argument('--downstream', default=PROXY_DOWNSTREAM_PORT,
+                        help='address to publish on')
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    try:
+        run(context, args.upstream, args.downstream)
+    except KeyboardInterrupt:
+        print("...\nInterrupt received; cleaning up and exiting.")
+    finally:
+        context.term()
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,8 @@ setup(
     entry_points={
         'console_scripts': [
             'paas_core=paas_core.core:main',
+            'paas_core_async=paas_core.async_core:main',
+            'paas_proxy=paas_core.proxy:main',
         ],
     },
     packages=(
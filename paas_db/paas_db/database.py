@@ -15,46 +15,232 @@
 #  limitations under the License.
 
 """This process listens on the pubsub socket and will put data it
-subscribes to into the database"""
+subscribes to into the database.
 
-import zmq
+The records are kept in a paas_db.logstore.LogStore, so storing a record
+appends it to the end of a log file rather than rewriting the whole
+database.
+
+Pixels from the 'paas_pixel', 'paas_multipixel' and 'paas_allpixels'
+topics are stored by key as
+
+  {'key': 'abc', 'rgb': [1, 2, 3], 'time': 1500000000}
+
+and removed by a 'paas_deletepixel' message naming the key, or a list of
+'keys'.
+
+Messages are read in batches, with later updates to a key replacing
+earlier ones, and each batch is committed to the log in a single write.
+Setting db_commit_interval holds updates for up to that many seconds so
+that bursts are gathered into even fewer commits.
+
+Records are read over the dbPort socket, either one raw key at a time or
+in bulk with the requests described in paas_db.query. Reads are served by
+a pool of db_reader_workers threads behind a ROUTER socket, which answer
+from an in-memory copy of the records that the ingest loop replaces after
+each batch. Readers therefore never wait on ingest or on the disk, while
+all writes still come from the one ingest loop. With db_reader_workers
+set to 0, reads are instead answered between batches by the ingest loop
+on a REP socket.
+
+A bounded history of each key's values is also kept in memory, as
+described in paas_db.history, and can be queried over the same socket.
+"""
+
+from itertools import islice
 import json
-import pickledb
-from paas_common import settings
+import threading
+import time
+import zmq
+from paas_common import messaging, settings, tracing
+from paas_db import query
+from paas_db.history import History
+from paas_db.logstore import LogStore
 
 context = zmq.Context()
-subsocket = context.socket(zmq.SUB)
-subsocket.connect(settings.pubSubPort)
-subsocket.setsockopt_string(zmq.SUBSCRIBE, u'pixel')
+subsocket = messaging.connect_subscriber(context, u'paas_')
+
+try:
+    DB_READER_WORKERS = settings.db_reader_workers
+except AttributeError:
+    DB_READER_WORKERS = 4
 
-servsocket = context.socket(zmq.REP)
+READER_BACKEND = 'inproc://paas_db_readers'
+
+servsocket = context.socket(zmq.ROUTER if DB_READER_WORKERS else zmq.REP)
 servsocket.bind(settings.dbPort)
 
 poller = zmq.Poller()
 poller.register(subsocket, zmq.POLLIN)
-poller.register(servsocket, zmq.POLLIN)
+if not DB_READER_WORKERS:
+    poller.register(servsocket, zmq.POLLIN)
+
+try:
+    DB_FSYNC = settings.db_fsync
+except AttributeError:
+    DB_FSYNC = False
+
+try:
+    DB_COMPACT_INTERVAL = settings.db_compact_interval
+except AttributeError:
+    DB_COMPACT_INTERVAL = 60
+
+try:
+    DB_COMMIT_INTERVAL = settings.db_commit_interval
+except AttributeError:
+    DB_COMMIT_INTERVAL = 0
+
+try:
+    DB_BATCH_SIZE = settings.db_batch_size
+except AttributeError:
+    DB_BATCH_SIZE = 1000
 
-dbconn = pickledb.load(settings.dbFile, True)
+dbconn = LogStore(settings.dbFile, fsync=DB_FSYNC,
+                  compact_interval=DB_COMPACT_INTERVAL)
 
+# records waiting to be committed by key, None for a deleted key
+pending = {}
 
-def retrieve_data(key):
-    return json.dumps(dbconn.get(key))
+# what readers see, including pending records; this is never modified, only
+# replaced, so the reader threads can use it freely
+records = dict(dbconn.index)
 
 
-def store_record():
-    response = subsocket.recv_string()
-    topic, *splitdata = response.split()
-    data = json.loads(' '.join(splitdata))
-    key = data.get('key', None)
-    if key is not None:
-        dbconn.set(key, data)
+history = History()
+
+# sequence number of the core snapshot the records were brought up to date
+# with; published messages up to it are already included
+snapshot_seq = None
+
+
+def retrieve_data(request):
+    """Return the reply to a request, which is always sent, so that the
+    serving socket and the reader workers survive any bad request."""
+    try:
+        return query.handle_request(request, records, history)
+    except Exception as e:
+        print("Failed to handle request {!r}: {}".format(request, e))
+        return json.dumps({'error': str(e)}).encode('utf-8')
+
+
+def reader_worker():
+    worker = context.socket(zmq.REP)
+    worker.connect(READER_BACKEND)
+    try:
+        while True:
+            request = worker.recv()
+            worker.send(retrieve_data(request))
+    except zmq.ContextTerminated:
+        pass
+    finally:
+        worker.close()
+
+
+def serve_readers():
+    """Pass requests from the serving socket to the reader workers until
+    the context is terminated."""
+    backend = context.socket(zmq.DEALER)
+    backend.bind(READER_BACKEND)
+    for _ in range(DB_READER_WORKERS):
+        threading.Thread(target=reader_worker, daemon=True).start()
+    try:
+        zmq.proxy(servsocket, backend)
+    except zmq.ContextTerminated:
+        pass
+    finally:
+        backend.close()
+        servsocket.close()
+
+
+def fold_message(message, batch):
+    """Add the pixels from the message to the batch of records."""
+    topic, data = message.topic, message.data
+    if not isinstance(data, dict):
+        return
+    if topic == 'paas_pixel':
+        pixels = [data]
+    elif topic == 'paas_multipixel':
+        pixels = data.get('pixels', [])
+    elif topic == 'paas_allpixels':
+        # keys deleted earlier in the batch are still in records
+        keys = (set(records) | set(batch)) - set(
+            k for k, v in batch.items() if v is None)
+        if isinstance(data.get('key'), str):
+            keys.add(data['key'])
+        pixels = [{'key': key, 'rgb': data.get('rgb')} for key in keys]
+    elif topic == 'paas_deletepixel':
+        for key in messaging.deleted_keys(data):
+            if isinstance(key, str):
+                batch[key] = None
+        return
+    else:
+        return
+
+    now = int(time.time())
+    for pixel in pixels:
+        # keys are stored as json object keys, so only strings will do
+        key = pixel.get('key', None) if isinstance(pixel, dict) else None
+        if isinstance(key, str):
+            batch[key] = {'key': key, 'rgb': pixel.get('rgb'), 'time': now}
+
+
+def store_records(messages=None):
+    """Read the messages, by default those waiting, into the pending
+    records and make them visible to readers."""
+    global records
+    if messages is None:
+        messages = islice(
+            messaging.drain_messages(subsocket, after=snapshot_seq),
+            DB_BATCH_SIZE)
+    batch = {}
+    for message in messages:
+        if message.trace is not None:
+            tracing.tracer.record(message.trace)
+        fold_message(message, batch)
+    if batch:
+        pending.update(batch)
+        updated = dict(records)
+        updated.update(batch)
+        for key, record in batch.items():
+            if record is None:
+                del updated[key]
+        records = updated
+        history.record(batch)
+
+
+def commit():
+    dbconn.update(pending)
+    pending.clear()
 
 
 def mainloop():
+    global snapshot_seq
+    if DB_READER_WORKERS:
+        threading.Thread(target=serve_readers, daemon=True).start()
+    # catch up with anything published while the database was not running
+    snapshot_seq, snapshot = messaging.fetch_snapshot(context, 'paas_')
+    store_records(snapshot)
+    commit()
+    commit_at = None
     while True:
-        socks = dict(poller.poll())
+        timeout = None
+        if commit_at is not None:
+            timeout = max(0, int((commit_at - time.monotonic()) * 1000))
+        socks = dict(poller.poll(timeout))
         if subsocket in socks:
-            store_record()
+            store_records()
+            if messaging.sequence_tracker.resync:
+                # messages were dropped; catch up with the core's state
+                seq, snapshot = messaging.resync(context, 'paas_', records)
+                if seq is not None:
+                    snapshot_seq = seq
+                store_records(snapshot)
+            if pending and commit_at is None:
+                commit_at = time.monotonic() + DB_COMMIT_INTERVAL
+
+        if commit_at is not None and time.monotonic() >= commit_at:
+            commit()
+            commit_at = None
 
         if servsocket in socks:
             data = retrieve_data(servsocket.recv())
@@ -62,14 +248,18 @@ def mainloop():
 
 
 def main():
+    tracing.report_on_signal(messaging.sequence_tracker.report)
     try:
         mainloop()
     except KeyboardInterrupt:
         print("...\nInterrupt received; cleaning up and exiting.")
     finally:
         subsocket.close()
-        servsocket.close()
+        if not DB_READER_WORKERS:
+            servsocket.close()
         context.term()
+        commit()
+        dbconn.close()
 
 if __name__ == '__main__':
     main()
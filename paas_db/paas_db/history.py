@@ -0,0 +1,124 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Bounded history of the values stored for each key.
+
+Every key keeps three fixed-size rings of samples: the raw values as they
+arrived, one sample per minute and one sample per hour. A downsampled
+sample holds the last value seen in its interval and how many values
+arrived in it. Once a ring is full its oldest sample is dropped, so the
+memory used per key stays the same however long the database runs. The
+history of a key is dropped when the key is deleted, so keys that come
+and go do not add up.
+
+The history is held in memory only and starts afresh when the database
+is restarted.
+"""
+
+from collections import deque
+import threading
+from paas_common import settings
+
+try:
+    HISTORY_RAW = settings.db_history_raw
+except AttributeError:
+    HISTORY_RAW = 120
+
+try:
+    HISTORY_MINUTES = settings.db_history_minutes
+except AttributeError:
+    HISTORY_MINUTES = 24 * 60
+
+try:
+    HISTORY_HOURS = settings.db_history_hours
+except AttributeError:
+    HISTORY_HOURS = 7 * 24
+
+# finest first: name, seconds per sample (None for raw) and ring size
+TIERS = (
+    ('raw', None, HISTORY_RAW),
+    ('minute', 60, HISTORY_MINUTES),
+    ('hour', 3600, HISTORY_HOURS),
+)
+
+
+class KeyHistory(object):
+
+    def __init__(self, tiers=TIERS):
+        self.tiers = tiers
+        # each sample is [time, rgb, count]
+        self.rings = {name: deque(maxlen=size) for name, _, size in tiers}
+
+    def record(self, when, rgb):
+        for name, interval, _ in self.tiers:
+            ring = self.rings[name]
+            if interval is None:
+                ring.append([when, rgb, 1])
+                continue
+            start = when - when % interval
+            if ring and ring[-1][0] == start:
+                ring[-1][1] = rgb
+                ring[-1][2] += 1
+            else:
+                ring.append([start, rgb, 1])
+
+    def choose_resolution(self, start):
+        """Return the finest tier that still reaches back to start."""
+        for name, _, size in self.tiers:
+            ring = self.rings[name]
+            if len(ring) < size or (ring and ring[0][0] <= start):
+                return name
+        return self.tiers[-1][0]
+
+    def samples(self, resolution, start, end):
+        return [{'time': when, 'rgb': rgb, 'count': count}
+                for when, rgb, count in list(self.rings[resolution])
+                if start <= when <= end]
+
+
+class History(object):
+
+    def __init__(self, tiers=TIERS):
+        self.tiers = tiers
+        self.keys = {}
+        self._lock = threading.Lock()
+
+    def record(self, records):
+        """Add the {'key', 'rgb', 'time'} records, keyed by key, dropping
+        the history of keys whose record is None."""
+        with self._lock:
+            for key, record in records.items():
+                if record is None:
+                    self.keys.pop(key, None)
+                    continue
+                history = self.keys.get(key)
+                if history is None:
+                    history = self.keys[key] = KeyHistory(self.tiers)
+                history.record(record.get('time', 0), record.get('rgb'))
+
+    def query(self, key, start=0, end=None, resolution=None):
+        """Return the resolution used and the samples for the key between
+        start and end, choosing the finest resolution that covers start
+        unless one is given."""
+        if resolution is not None and resolution not in (
+                name for name, _, _ in self.tiers):
+            raise ValueError("Unknown resolution {!r}".format(resolution))
+        end = float('inf') if end is None else end
+        with self._lock:
+            history = self.keys.get(key)
+            if history is None:
+                return resolution or self.tiers[0][0], []
+            if resolution is None:
+                resolution = history.choose_resolution(start)
+            return resolution, history.samples(resolution, start, end)
@@ -0,0 +1,250 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""A key/value store held in memory and persisted as an append-only log.
+
+Every change is appended to the log as a single line:
+
+  <crc32 of the json, 8 hex digits> <json>
+
+where the json is ["s", key, value] for a set or ["d", key] for a
+delete, so the cost of a write depends only on the record being written.
+On loading, the log is replayed up to the first record that is
+incomplete or fails its checksum, and anything after that, which can
+only be the remains of an interrupted write, is truncated away.
+
+A file whose first record cannot be read is not a log written here. If
+it holds a single json object, as written by pickledb, its keys are
+imported into a new log; otherwise the store starts empty. Either way
+the original file is first copied to <path>.orig, or to <path>.orig.<n>
+if that is taken, so nothing is lost.
+
+A background thread compacts the log once it has grown to several times
+the size of the live data. The current contents are written to a new
+file, and any records appended meanwhile are copied across before the
+new file replaces the log with an atomic rename. If compaction is
+interrupted the original log is untouched.
+"""
+
+import json
+import os
+import os.path
+import shutil
+import threading
+import zlib
+
+
+class LogStore(object):
+
+    def __init__(self, path, fsync=False, compact_ratio=4,
+                 compact_min_bytes=1 << 20, compact_interval=60):
+        self.path = path
+        self.fsync = fsync
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.index = {}
+        # size of the record currently holding each key's value
+        self._record_sizes = {}
+        self._live_bytes = 0
+        self._log_bytes = 0
+        self._pending = None
+        self._lock = threading.RLock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._compact_path()):
+            os.remove(self._compact_path())
+        self._load()
+        self._log = open(self.path, 'ab')
+
+        self._stop = threading.Event()
+        self._compactor = None
+        if compact_interval:
+            self._compactor = threading.Thread(
+                target=self._compact_periodically, args=(compact_interval,),
+                daemon=True)
+            self._compactor.start()
+
+    def _compact_path(self):
+        return self.path + '.compact'
+
+    @staticmethod
+    def _encode(record):
+        body = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        return b'%08x ' % zlib.crc32(body) + body + b'\n'
+
+    @staticmethod
+    def _decode(line):
+        if len(line) < 10 or not line.endswith(b'\n') or line[8:9] != b' ':
+            return None
+        body = line[9:-1]
+        try:
+            if int(line[:8], 16) != zlib.crc32(body):
+                return None
+            return json.loads(body.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def _apply(self, record, size):
+        if record[0] == 's':
+            key = record[1]
+            self.index[key] = record[2]
+            self._live_bytes += size - self._record_sizes.get(key, 0)
+            self._record_sizes[key] = size
+        elif record[0] == 'd':
+            self.index.pop(record[1], None)
+            self._live_bytes -= self._record_sizes.pop(record[1], 0)
+        self._log_bytes += size
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        with open(self.path, 'rb') as log:
+            for line in log:
+                record = self._decode(line)
+                if record is None:
+                    break
+                self._apply(record, len(line))
+                good += len(line)
+        if good == 0 and os.path.getsize(self.path):
+            self._import()
+        elif good != os.path.getsize(self.path):
+            print("Truncating {} bytes of incomplete log in {}".format(
+                os.path.getsize(self.path) - good, self.path))
+            with open(self.path, 'r+b') as log:
+                log.truncate(good)
+
+    def _import(self):
+        backup = self.path + '.orig'
+        n = 0
+        while os.path.exists(backup):
+            n += 1
+            backup = '{}.orig.{}'.format(self.path, n)
+        with open(self.path, 'rb') as f:
+            try:
+                data = json.loads(f.read().decode('utf-8'))
+            except ValueError:
+                data = None
+        shutil.copy2(self.path, backup)
+        if not isinstance(data, dict):
+            print("{} is not a log; starting empty, with the original kept "
+                  "in {}".format(self.path, backup))
+            data = {}
+        else:
+            print("Importing {} keys from {}, with the original kept in "
+                  "{}".format(len(data), self.path, backup))
+
+        tmp = self._compact_path()
+        with open(tmp, 'wb') as f:
+            for key, value in data.items():
+                line = self._encode(['s', key, value])
+                f.write(line)
+                self._apply(['s', key, value], len(line))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _sync(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def _append(self, records):
+        lines = [self._encode(r) for r in records]
+        data = b''.join(lines)
+        with self._lock:
+            self._log.write(data)
+            self._sync(self._log)
+            if self._pending is not None:
+                self._pending.append(data)
+            for record, line in zip(records, lines):
+                self._apply(record, len(line))
+
+    def get(self, key, default=None):
+        return self.index.get(key, default)
+
+    def set(self, key, value):
+        self._append([['s', key, value]])
+
+    def update(self, records):
+        """Set every key in the mapping with a single write to the log,
+        deleting those whose value is None."""
+        if records:
+            self._append([['d', k] if v is None else ['s', k, v]
+                          for k, v in records.items()])
+
+    def delete(self, key):
+        if key in self.index:
+            self._append([['d', key]])
+
+    def keys(self):
+        return list(self.index)
+
+    def items(self):
+        return list(self.index.items())
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def needs_compaction(self):
+        return self._log_bytes > max(self.compact_min_bytes,
+                                     self.compact_ratio * self._live_bytes)
+
+    def compact(self):
+        with self._lock:
+            snapshot = dict(self.index)
+            self._pending = []
+
+        tmp = self._compact_path()
+        try:
+            with open(tmp, 'wb') as f:
+                for key, value in snapshot.items():
+                    f.write(self._encode(['s', key, value]))
+                f.flush()
+                os.fsync(f.fileno())
+
+            with self._lock:
+                with open(tmp, 'ab') as f:
+                    for data in self._pending:
+                        f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._log.close()
+                os.replace(tmp, self.path)
+                self._log = open(self.path, 'ab')
+                self._log_bytes = os.path.getsize(self.path)
+        finally:
+            with self._lock:
+                self._pending = None
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _compact_periodically(self, interval):
+        while not self._stop.wait(interval):
+            if self.needs_compaction():
+                self.compact()
+
+    def close(self):
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            if not self._log.closed:
+                self._sync(self._log)
+                self._log.close()
@@ -0,0 +1,114 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""The request protocol of the database's serving socket.
+
+A request is a json object naming an operation:
+
+  {"op": "get", "keys": ["a", "b"]}   the records for each of the keys,
+                                      null for those that are not stored
+  {"op": "scan", "prefix": "item_"}   the records whose keys start with
+                                      the prefix
+  {"op": "snapshot"}                  every stored record
+
+and is answered with {"pixels": {key: record, ...}}, or {"error": "..."}
+if the request could not be handled.
+
+The history of a key's values can be queried with
+
+  {"op": "history", "key": "a", "start": 1500000000, "end": 1500003600,
+   "resolution": "minute"}
+
+where start, end and resolution ("raw", "minute" or "hour") are optional,
+the finest resolution reaching back to start being used by default. This
+is answered with {"key": "a", "resolution": "minute", "samples":
+[{"time": ..., "rgb": [...], "count": ...}, ...]}. For compatibility, a
+request that is not a json object is taken to be a single raw key and is
+answered with its record alone, or null.
+"""
+
+import json
+
+
+def _get(request, records):
+    keys = request.get('keys')
+    if not isinstance(keys, list) or not all(
+            isinstance(key, str) for key in keys):
+        raise ValueError("'get' needs a list of string 'keys'")
+    return {'pixels': {key: records.get(key) for key in keys}}
+
+
+def _scan(request, records):
+    prefix = request.get('prefix', '')
+    if not isinstance(prefix, str):
+        raise ValueError("'scan' needs a string 'prefix'")
+    return {'pixels': {key: value for key, value in records.items()
+                       if key.startswith(prefix)}}
+
+
+def _snapshot(request, records):
+    return {'pixels': dict(records)}
+
+
+def _history(request, records, history):
+    key = request.get('key')
+    if not isinstance(key, str):
+        raise ValueError("'history' needs a 'key'")
+    start = request.get('start', 0)
+    end = request.get('end')
+    if not isinstance(start, (int, float)) or not (
+            end is None or isinstance(end, (int, float))):
+        raise ValueError("'start' and 'end' must be times in seconds")
+    resolution, samples = history.query(
+        key, start, end, request.get('resolution'))
+    return {'key': key, 'resolution': resolution, 'samples': samples}
+
+
+OPERATIONS = {
+    'get': _get,
+    'scan': _scan,
+    'snapshot': _snapshot,
+}
+
+
+def parse_request(raw):
+    """Return the request as a dict, or the raw key as a string."""
+    key = raw.decode('utf-8', 'replace')
+    try:
+        request = json.loads(key)
+    except ValueError:
+        return key
+    return request if isinstance(request, dict) else key
+
+
+def handle_request(raw, records, history=None):
+    """Return the encoded reply to a raw request, answered from the
+    records mapping and the paas_db.history.History, if any."""
+    request = parse_request(raw)
+    if isinstance(request, str):
+        reply = records.get(request)
+    else:
+        op = request.get('op')
+        try:
+            if not isinstance(op, str):
+                raise ValueError("'op' must be a string")
+            if op == 'history' and history is not None:
+                reply = _history(request, records, history)
+            elif op in OPERATIONS:
+                reply = OPERATIONS[op](request, records)
+            else:
+                reply = {'error': "Unknown op {!r}".format(op)}
+        except ValueError as e:
+            reply = {'error': str(e)}
+    return json.dumps(reply).encode('utf-8')
@@ -0,0 +1,119 @@
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+from paas_db.logstore import LogStore
+
+
+class LogStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open_store(self):
+        store = LogStore(self.path, compact_interval=0)
+        self.addCleanup(store.close)
+        return store
+
+    def test_replays_log(self):
+        store = self.open_store()
+        store.set('a', {'rgb': [1, 2, 3]})
+        store.update({'b': 2, 'c': 3})
+        store.delete('c')
+        store.close()
+
+        store = self.open_store()
+        self.assertEqual(dict(store.items()), {'a': {'rgb': [1, 2, 3]},
+                                               'b': 2})
+
+    def test_truncates_torn_tail(self):
+        store = self.open_store()
+        store.set('a', 1)
+        store.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b'0000abcd ["s","b",')
+
+        store = self.open_store()
+        self.assertEqual(dict(store.items()), {'a': 1})
+        self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_stops_at_bad_checksum(self):
+        store = self.open_store()
+        store.set('a', 1)
+        store.set('b', 2)
+        store.close()
+        with open(self.path, 'rb') as f:
+            lines = f.readlines()
+        with open(self.path, 'wb') as f:
+            f.write(lines[0] + b'00000000' + lines[1][8:])
+
+        store = self.open_store()
+        self.assertEqual(dict(store.items()), {'a': 1})
+
+    def test_imports_json_database(self):
+        legacy = {'a': {'key': 'a', 'rgb': [1, 2, 3], 'time': 1}}
+        with open(self.path, 'w') as f:
+            json.dump(legacy, f)
+
+        store = self.open_store()
+        self.assertEqual(dict(store.items()), legacy)
+        with open(self.path + '.orig') as f:
+            self.assertEqual(json.load(f), legacy)
+        store.close()
+
+        store = self.open_store()
+        self.assertEqual(dict(store.items()), legacy)
+
+    def test_keeps_unreadable_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a log\n')
+
+        store = self.open_store()
+        self.assertEqual(len(store), 0)
+        with open(self.path + '.orig', 'rb') as f:
+            self.assertEqual(f.read(), b'not a log\n')
+
+    def test_compaction_keeps_live_data(self):
+        store = LogStore(self.path, compact_ratio=1, compact_min_bytes=0,
+                         compact_interval=0)
+        self.addCleanup(store.close)
+        for i in range(10):
+            store.set('a', i)
+        store.set('b', 'x')
+        store.delete('b')
+        size = os.path.getsize(self.path)
+        self.assertTrue(store.needs_compaction())
+
+        store.compact()
+        self.assertLess(os.path.getsize(self.path), size)
+        self.assertFalse(os.path.exists(self.path + '.compact'))
+        store.set('c', 3)
+        store.close()
+
+        store = self.open_store()
+        self.assertEqual(dict(store.items()), {'a': 9, 'c': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
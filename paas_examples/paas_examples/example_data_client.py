@@ -21,16 +21,14 @@ display.
 """
 
 import zmq
-import json
 import random
 import time
 import itertools
-from paas_common import settings
+from paas_common import messaging
 
 context = zmq.Context()
 
-sender = context.socket(zmq.REQ)
-sender.connect(settings.dataInputPort)
+sender = messaging.connect_sender(context)
 
 GOOD = (0, 0, 255)
 WARNING = (255, 106, 0)
@@ -38,23 +36,17 @@ ERROR = (255, 0, 0)
 
 def individual_pixel_demo():
     for j in range(100):
-        for i in range(64):
-            rgb = random.choice((GOOD, WARNING, ERROR))
-            data = {
-                'topic': 'paas_pixel',
-                'data': {
-                    'key': "item_{}".format(i),
-                    'rgb': rgb,
-                },
+        pixels = [
+            {
+                'key': "item_{}".format(i),
+                'rgb': random.choice((GOOD, WARNING, ERROR)),
             }
-            sender.send_json(json.dumps(data))
-            response = sender.recv_json()
+            for i in range(64)
+        ]
         data = {
-            'topic': 'paas_showpixels',
-            'data': {},
+            'pixels': pixels,
         }
-        sender.send_json(json.dumps(data))
-        response = sender.recv_json()
+        messaging.send_data(sender, 'paas_multipixel', data)
 
 
 def full_display_demo():
@@ -62,14 +54,10 @@ def full_display_demo():
         if i > 100:
             break
         data = {
-            'topic': 'paas_allpixels',
-            'data': {
-                'key': "item_{}".format(i),
-                'rgb': status,
-            },
+            'key': "item_{}".format(i),
+            'rgb': status,
         }
-        sender.send_json(json.dumps(data))
-        response = sender.recv_json()
+        messaging.send_data(sender, 'paas_allpixels', data)
         time.sleep(1)
 
 
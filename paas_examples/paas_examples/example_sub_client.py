@@ -18,16 +18,13 @@
 
 import sys
 import zmq
-import json
-from paas_common import settings
+from paas_common import messaging
 
 context = zmq.Context()
 
-listener = context.socket(zmq.SUB)
-listener.connect(settings.pubSubPort)
-listener.setsockopt(zmq.SUBSCRIBE, b'pixel')
+listener = messaging.connect_subscriber(context, 'paas_')
 
 while True:
-    data = listener.recv()
+    message = messaging.recv_message(listener)
 
-    print("received:" , data)
+    print("received:", message.topic, message.data)
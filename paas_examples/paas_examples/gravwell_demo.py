@@ -17,15 +17,13 @@
 """A simulation of gravwell"""
 
 from itertools import cycle
-import json
 import zmq
 import random
 import time
-from paas_common import settings
+from paas_common import messaging
 
 context = zmq.Context()
-sender = context.socket(zmq.REQ)
-sender.connect(settings.dataInputPort)
+sender = messaging.connect_sender(context)
 
 frame_length = 0.2
 between_game_frame_length = 5
@@ -103,64 +101,39 @@ def reset_state():
 
 
 def _set_display(pixels):
-    pixel_data = {
+    pixel_data = [
         {
             'key': "item_{}".format(pixel),
             'rgb': colour,
         }
         for (pixel, colour) in pixels
-    }
-
-    data = {
-        'topic': 'paas_multipixel',
-        'data': {
-            'pixels': pixel_data,
-            'show': True,
-        },
-    }
-    sender.send_json(json.dumps(data))
-    sender.recv_json()
-
-
-def _set_pixel(pixel, colour):
-    data = {
-        'topic': 'paas_pixel',
-        'data': {
-            'key': "item_{}".format(pixel),
-            'rgb': colour,
-            'show': False,
-        },
-    }
-    sender.send_json(json.dumps(data))
-    sender.recv_json()
-
+    ]
 
-def _request_display():
     data = {
-        'topic': 'paas_showpixels',
-        'data': {},
+        'pixels': pixel_data,
+        'show': True,
     }
-    sender.send_json(json.dumps(data))
-    sender.recv_json()
+    messaging.send_data(sender, 'paas_multipixel', data)
 
 
 def _blank_out():
-    for pos in (range(LED_COUNT)):
-        _set_pixel(pos, BLACK)
+    _set_display((pos, BLACK) for pos in range(LED_COUNT))
 
 
-def _set_background():
-    for pos in reversed(range(LED_COUNT)):
-        _set_pixel(pos, next(gravwell_bg_iter))
+def _background_pixels():
+    pixels = [(pos, next(gravwell_bg_iter))
+              for pos in reversed(range(LED_COUNT))]
     next(gravwell_bg_iter)
+    return pixels
 
 
 def display_state(state):
-    _set_background()
+    pixels = _background_pixels()
     for player, playerstate in state.items():
         if playerstate['pos'] > -1:
-            _set_pixel(LED_COUNT - playerstate['pos'], playerstate['colour'])
-    _request_display()
+            pixels.append(
+                (LED_COUNT - playerstate['pos'], playerstate['colour']))
+    _set_display(pixels)
 
 
 def next_free(state, position, direction):
@@ -14,18 +14,49 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-"""A client for watching jenkins jobs."""
-
+"""A client for watching jenkins jobs.
+
+Each server is asked for the last completed build of all of its jobs in a
+single request, and the servers are polled in parallel. A server that has
+not answered within jenkins_poll_timeout seconds is left to finish in the
+background, its jobs keeping their last known results, and is not asked
+again until it has answered.
+
+With jenkins_pixel_mode set to 'summary', the default, the whole display
+shows green only while every job's last build succeeded. Set to 'job',
+each job gets a pixel of its own, keyed by the job's 'key' if it has one
+and by its name otherwise. Either way a message is only sent when what
+is shown changes, with all of a poll's changes to job pixels sent
+together.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
 import zmq
-import json
 import time
 import jenkins
-from paas_common import settings
+from paas_common import messaging, settings
+
+try:
+    POLL_INTERVAL = settings.jenkins_poll_interval
+except AttributeError:
+    POLL_INTERVAL = 15
+
+try:
+    POLL_TIMEOUT = settings.jenkins_poll_timeout
+except AttributeError:
+    POLL_TIMEOUT = 10
+
+try:
+    PIXEL_MODE = settings.jenkins_pixel_mode
+except AttributeError:
+    PIXEL_MODE = 'summary'
+
+# only the fields needed from each job, in one request per server
+JOBS_QUERY = '?tree=jobs[name,lastCompletedBuild[number,result]]'
 
 context = zmq.Context()
 
-sender = context.socket(zmq.REQ)
-sender.connect(settings.dataInputPort)
+sender = messaging.connect_sender(context)
 
 SUCCESS = (0, 0, 255)
 WARNING = (255, 106, 0)
@@ -64,49 +95,119 @@ for alert in alerts:
     alert['server'] = server
 
 
-def get_unseen_job_status(server, job):
-    jobname = job['name']
-    lastSeen = job.get('lastSeen', -1)
-    lastComplete = server.get_job_info(jobname)['lastCompletedBuild']['number']
-    job['lastSeen'] = lastComplete
-    if lastComplete <= lastSeen:
-        return job.get('cached_result', None)
-
-    result = server.get_build_info(jobname, lastComplete)['result']
-    job['cached_result'] = result
-    print('Found new result: {} ({}): {}'.format(jobname, lastComplete, result))
-    return result
-
-
-def send_data(key, rgb):
-    data = {
-        'topic': 'paas_allpixels',
-        'data': {
-            'key': "item_{}".format(key),
-            'rgb': rgb,
-        },
-    }
-    sender.send_json(json.dumps(data))
-    sender.recv_json()
+def fetch_builds(server):
+    """Return the number and result of the last completed build of each
+    job on the server, by job name."""
+    builds = {}
+    for info in server.get_info(query=JOBS_QUERY).get('jobs', []):
+        build = info.get('lastCompletedBuild') or {}
+        builds[info['name']] = (build.get('number', -1), build.get('result'))
+    return builds
+
+
+def poll_servers(executor, polls):
+    """Start polling each server not already being polled and wait up to
+    POLL_TIMEOUT for the polls to finish, updating the jobs of each
+    server that answers. polls holds the unfinished poll of each alert."""
+    for index, alert in enumerate(alerts):
+        if index not in polls:
+            polls[index] = executor.submit(fetch_builds, alert['server'])
+    wait(polls.values(), timeout=POLL_TIMEOUT)
+
+    for index, poll in list(polls.items()):
+        if not poll.done():
+            print('Still waiting for {}'.format(alerts[index]['server_url']))
+            continue
+        del polls[index]
+        try:
+            builds = poll.result()
+        except Exception as e:
+            print('Failed to poll {}: {}'.format(
+                alerts[index]['server_url'], e))
+            continue
+        update_jobs(alerts[index], builds)
+
+
+def update_jobs(alert, builds):
+    for job in alert['jobs']:
+        jobname = job['name']
+        job['found'] = jobname in builds
+        if not job['found']:
+            continue
+        lastComplete, result = builds[jobname]
+        if lastComplete <= job.get('lastSeen', -1):
+            continue
+        job['lastSeen'] = lastComplete
+        job['cached_result'] = result
+        print('Found new result: {} ({}): {}'.format(
+            jobname, lastComplete, result))
+
+
+def job_colour(result):
+    if result == 'SUCCESS':
+        return SUCCESS
+    if result == 'UNSTABLE':
+        return WARNING
+    return ERROR
+
+
+def job_key(job):
+    return job.get('key', 'jenkins_{}'.format(job['name']))
+
+
+def send_summary(last):
+    """Show whether every job succeeded across the display if that has
+    changed from last, returning what is shown."""
+    results = [job.get('cached_result') == 'SUCCESS'
+               for alert in alerts for job in alert['jobs']
+               if job.get('found')]
+    rgb = SUCCESS if all(results) else ERROR
+    if rgb != last:
+        messaging.send_data(sender, 'paas_allpixels', {'rgb': list(rgb)})
+    return rgb
+
+
+def send_job_pixels():
+    """Send the pixels of the jobs whose colour has changed as a single
+    message, and delete those of jobs that are no longer found with
+    another."""
+    pixels = []
+    deleted = []
+    for alert in alerts:
+        for job in alert['jobs']:
+            shown = job.get('shown')
+            if not job.get('found') or job.get('cached_result') is None:
+                if shown is not None and not job.get('found'):
+                    deleted.append(job_key(job))
+                    job['shown'] = None
+                continue
+            rgb = job_colour(job['cached_result'])
+            if rgb != shown:
+                pixels.append({'key': job_key(job), 'rgb': list(rgb)})
+                job['shown'] = rgb
+    if deleted:
+        messaging.send_data(sender, 'paas_deletepixel', {'keys': deleted})
+    if pixels:
+        messaging.send_data(sender, 'paas_multipixel', {'pixels': pixels})
 
 
 def mainloop():
-    while True:
-        results = []
-        for alert in alerts:
-            server = alert['server']
-            all_jobs = [j['name'] for j in server.get_jobs()]
-            for job in alert['jobs']:
-                jobname = job['name']
-                if jobname not in all_jobs:
-                    continue
-
-                result = get_unseen_job_status(server, job)
-                results.append(result == 'SUCCESS')
-
-        rgb = SUCCESS if all(results) else ERROR
-        send_data(jobname, rgb)
-        time.sleep(15)
+    polls = {}
+    summary = None
+    executor = ThreadPoolExecutor(max_workers=len(alerts))
+    try:
+        while True:
+            started = time.monotonic()
+            poll_servers(executor, polls)
+
+            if PIXEL_MODE == 'job':
+                send_job_pixels()
+            else:
+                summary = send_summary(summary)
+            time.sleep(max(0, POLL_INTERVAL - (time.monotonic() - started)))
+    finally:
+        # don't wait for a server that is not answering
+        executor.shutdown(wait=False)
 
 
 def main():
@@ -21,6 +21,17 @@ anything that has valid json in the form
 
   {'key': 'abc', 'rgb': [1, 2, 3]}
 
+Several pixels can be updated with a single 'paas_multipixel' message
+that is rendered once all of the pixels have been set:
+
+  {'pixels': [{'key': 'abc', 'rgb': [1, 2, 3]}, ...]}
+
+and a 'paas_deletepixel' message naming a key, or a list of 'keys',
+blanks their pixels and frees their positions for other keys.
+
+Updates are shown at most render.DISPLAY_FPS times a second, with any
+that arrive in between coalesced into a single refresh.
+
 Note that this is not necessarily directly related to how the data
 should be structured for input to the publisher - this is only what
 the publisher should provide that this subscriber will understand.
@@ -33,12 +44,11 @@ associated with this.
 """
 
 
-import json
-import random
 import sys
 import zmq
 import unicornhat as unicorn
-from paas_common import settings
+from paas_common import display, messaging, tracing
+from paas_common.framebuffer import FrameBuffer
 
 
 unicorn.set_layout(unicorn.AUTO)
@@ -46,70 +56,36 @@ unicorn.rotation(0)
 unicorn.brightness(1)
 
 WIDTH, HEIGHT = unicorn.get_shape()
-keymap = {}
-all_positions = set((i, j) for i in range(WIDTH) for j in range(HEIGHT))
+all_positions = list((i, j) for i in range(WIDTH) for j in range(HEIGHT))
 
 context = zmq.Context()
-subsocket = context.socket(zmq.SUB)
-subsocket.connect(settings.pubSubPort)
 
 topic_filter = sys.argv[1] if len(sys.argv) > 1 else "paas_"
 
 if isinstance(topic_filter, bytes):
     topic_filter = topic_filter.decode('ascii')
-subsocket.setsockopt_string(zmq.SUBSCRIBE, topic_filter)
-
-try:
-    ALLOCATION_SCHEME = settings.pixel_allocation_scheme
-except AttributeError:
-    ALLOCATION_SCHEME = 'linear'
-
-
-def get_position_for_key(key):
-    if key in keymap:
-        return keymap[key]
-
-    positions = all_positions - set(keymap.values())
-    if not positions:
-        return (0, 0)
-
-    if ALLOCATION_SCHEME == 'random':
-        position = random.choice(list(positions))
-    else:
-        position = sorted(list(positions))[-1]
-    keymap[key] = position
-    return position
-
-
-def set_pixel(data):
-    key = data.get('key', None)
-    x, y = get_position_for_key(key)
-    r, g, b = data.get('rgb', (None, None, None))
-    unicorn.set_pixel(x, y, r, g, b)
-
+subsocket = messaging.connect_subscriber(context, topic_filter)
 
-def set_all_pixels(data):
-    r, g, b = data.get('rgb', (None, None, None))
-    unicorn.set_all(r, g, b)
 
+class UnicornHatDisplay(display.Display):
 
-def mainloop():
-    while True:
-        response = subsocket.recv_string()
-        topic, *splitdata = response.split()
-        data = json.loads(' '.join(splitdata))
-        if topic == 'paas_pixel':
-            set_pixel(data)
-        elif topic == 'paas_allpixels':
-            set_all_pixels(data)
+    def __init__(self):
+        super(UnicornHatDisplay, self).__init__(
+            FrameBuffer(WIDTH, HEIGHT), all_positions)
+        # what the hat is currently showing
+        self.presented = FrameBuffer(WIDTH, HEIGHT)
 
-        if topic == 'paas_showpixels' or data.get('show', True):
-            unicorn.show()
+    def update_display(self):
+        for x, y, rgb in self.framebuffer.changed_pixels(self.presented):
+            unicorn.set_pixel(x, y, *rgb)
+        self.presented.blit(self.framebuffer)
+        unicorn.show()
 
 
 def main():
+    tracing.report_on_signal(messaging.sequence_tracker.report)
     try:
-        mainloop()
+        UnicornHatDisplay().run(subsocket, context, topic_filter)
     except KeyboardInterrupt:
         print("...\nInterrupt received; cleaning up and exiting.")
     finally:
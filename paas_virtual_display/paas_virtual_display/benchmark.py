@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Measures how long injected data takes to reach a display.
+
+The benchmark starts a core, unless one is already running, attaches a
+virtual display to it and has a number of producers inject pixel updates
+as fast as they can or at a fixed rate. Every update uses a new key so
+that the time it was sent can be matched against the time the display
+was shown with it. Throughput and the spread of the ingest to display
+latency are reported at the end, along with how many messages never
+reached the display.
+"""
+
+import argparse
+import subprocess
+import sys
+import threading
+import time
+import zmq
+from paas_common import messaging, render
+from paas_virtual_display.virtual_display import VirtualDisplay, connect
+
+
+class BenchmarkDisplay(VirtualDisplay):
+    """A virtual display that records the latency of each key it shows."""
+
+    def __init__(self, sent, **kwargs):
+        super(BenchmarkDisplay, self).__init__(**kwargs)
+        self.sent = sent
+        self.pending = []
+        self.latencies = []
+        self.last_show = None
+
+    def set_pixel(self, data):
+        self.pending.append(data.get('key'))
+        return super(BenchmarkDisplay, self).set_pixel(data)
+
+    def update_display(self):
+        now = time.perf_counter()
+        for key in self.pending:
+            sent = self.sent.get(key)
+            if sent is not None:
+                self.latencies.append(now - sent)
+        self.pending = []
+        self.last_show = now
+        super(BenchmarkDisplay, self).update_display()
+
+
+def produce(context, producer, count, rate, sent):
+    sender = messaging.connect_sender(context)
+    interval = 1.0 / rate if rate else 0
+    start = time.perf_counter()
+    for i in range(count):
+        if interval:
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        key = 'bench_{}_{}'.format(producer, i)
+        data = {
+            'key': key,
+            'rgb': [i % 256, (i // 256) % 256, producer % 256],
+        }
+        sent[key] = time.perf_counter()
+        messaging.send_data(sender, 'paas_pixel', data)
+    sender.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def run(producers, count, rate, fps, settle):
+    context = zmq.Context()
+    sent = {}
+    display = BenchmarkDisplay(sent, fps=fps)
+    stop = threading.Event()
+    subsocket = connect(context)
+    display_thread = threading.Thread(
+        target=display.run, args=(subsocket,), kwargs={'stop': stop})
+    display_thread.start()
+    # give the subscription time to reach the core
+    time.sleep(0.5)
+
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=produce,
+                         args=(context, p, count, rate, sent))
+        for p in range(producers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total = producers * count
+    while len(display.latencies) < total:
+        last = display.last_show or start
+        if time.perf_counter() - last > settle:
+            break
+        time.sleep(0.01)
+    elapsed = (display.last_show or time.perf_counter()) - start
+
+    stop.set()
+    display_thread.join()
+    subsocket.close()
+    context.term()
+    return total, elapsed, display.frames, display.latencies
+
+
+def report(total, elapsed, frames, latencies):
+    print("messages sent:     {}".format(total))
+    print("messages shown:    {}".format(len(latencies)))
+    # counted here as well as by the subscriber, since messages dropped
+    # after the last one it received leave no gap for it to notice
+    print("messages lost:     {}".format(total - len(latencies)))
+    print("subscriber:        {}".format(messaging.sequence_tracker.report()))
+    print("frames shown:      {}".format(frames))
+    print("elapsed:           {:.3f} s".format(elapsed))
+    if elapsed > 0:
+        print("throughput:        {:.0f} msg/s".format(
+            len(latencies) / elapsed))
+    if latencies:
+        print("latency p50:       {:.3f} ms".format(
+            percentile(latencies, 0.5) * 1000))
+        print("latency p99:       {:.3f} ms".format(
+            percentile(latencies, 0.99) * 1000))
+        print("latency max:       {:.3f} ms".format(max(latencies) * 1000))
+    if len(latencies) < total:
+        print("warning: throughput and latency only cover the messages "
+              "shown")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--producers', type=int, default=4)
+    parser.add_argument('--count', type=int, default=5000,
+                        help='messages sent by each producer')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='messages per second from each producer, '
+                             '0 for as fast as possible')
+    parser.add_argument('--fps', type=float, default=render.DISPLAY_FPS,
+                        help='display frame rate, 0 for uncapped')
+    parser.add_argument('--settle', type=float, default=1.0,
+                        help='seconds without a frame before giving up on '
+                             'the remaining messages')
+    parser.add_argument('--no-core', action='store_true',
+                        help='use a core that is already running')
+    args = parser.parse_args()
+
+    core = None
+    if not args.no_core:
+        core = subprocess.Popen([sys.executable, '-m', 'paas_core.core'])
+        time.sleep(0.5)
+    try:
+        report(*run(args.producers, args.count, args.rate, args.fps,
+                    args.settle))
+    finally:
+        if core is not None:
+            core.terminate()
+            core.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+#  Copyright 2017 Gary Martin
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""This is a display that needs no hardware.
+
+It understands the same topics as the unicornhat and blinkytape displays
+and renders into an in-memory framebuffer, optionally drawing it in the
+terminal with 24-bit colour escape codes each time it is shown. It is
+useful for trying things out without a display attached and for
+benchmarking the rest of the pipeline.
+
+Unlike the hardware displays, the sockets are only created when it is run
+so that the display can also be driven from other programs, such as the
+benchmark.
+"""
+
+import argparse
+import sys
+import zmq
+from paas_common import display, messaging, render, settings, tracing
+from paas_common.framebuffer import FrameBuffer
+
+try:
+    WIDTH = settings.virtual_display_width
+except AttributeError:
+    WIDTH = 8
+
+try:
+    HEIGHT = settings.virtual_display_height
+except AttributeError:
+    HEIGHT = 8
+
+
+class VirtualDisplay(display.Display):
+
+    def __init__(self, width=WIDTH, height=HEIGHT, preview=False,
+                 fps=render.DISPLAY_FPS):
+        super(VirtualDisplay, self).__init__(
+            FrameBuffer(width, height),
+            [(i, j) for i in range(width) for j in range(height)], fps=fps)
+        self.preview = preview
+        self.frames = 0
+
+    def update_display(self):
+        self.frames += 1
+        if self.preview:
+            self.draw()
+
+    def draw(self, out=sys.stdout):
+        fb = self.framebuffer
+        lines = ['\x1b[H']
+        for y in range(fb.height):
+            cells = ('\x1b[48;2;{};{};{}m  '.format(*fb.get_pixel(x, y))
+                     for x in range(fb.width))
+            lines.append(''.join(cells) + '\x1b[0m\n')
+        out.write(''.join(lines))
+        out.flush()
+
+
+def connect(context, topic_filter='paas_'):
+    return messaging.connect_subscriber(context, topic_filter)
+
+
+def main():
+    tracing.report_on_signal(messaging.sequence_tracker.report)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('topic_filter', nargs='?', default='paas_')
+    parser.add_argument('--preview', action='store_true',
+                        help='draw the display in the terminal')
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    subsocket = connect(context, args.topic_filter)
+    virtual = VirtualDisplay(preview=args.preview)
+    if args.preview:
+        sys.stdout.write('\x1b[2J')
+    try:
+        virtual.run(subsocket, context, args.topic_filter)
+    except KeyboardInterrupt:
+        print("...\nInterrupt received; cleaning up and exiting.")
+    finally:
+        subsocket.close()
+        context.term()
+
+if __name__ == '__main__':
+    main()